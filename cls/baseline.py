@@ -7,15 +7,24 @@ import numpy as np
 import sys
 import os
 import textwrap
+import hashlib
+import atexit
+import shutil
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
 import cPickle as pkl
-from scipy.sparse import hstack
+from scipy.sparse import hstack, csr_matrix, issparse
 
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.feature_extraction.text import TfidfTransformer
 from sklearn.feature_selection import SelectKBest, chi2, f_classif
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, StratifiedKFold
+from sklearn.base import clone
+from sklearn.externals.joblib import Parallel, delayed
 from sklearn.metrics import accuracy_score
+from sklearn.utils.class_weight import compute_sample_weight
 
 def load_vocab(vocab_path):
     print "loading vocab ...",
@@ -100,15 +109,292 @@ class CustomSelectKBest(SelectKBest):
   def transform_vectorizer(self, cv):
     cv.vocabulary_ = self.transform_vocabulary(cv.vocabulary_)
 
+def tfidf_features(counts):
+    """
+    :param counts: x_train, x_test, x_valid (or None), vocabulary
+    :return: the same with every count matrix TFIDF weighted
+    """
+    return tuple([TfidfTransformer().fit_transform(x) if x is not None and i < 3 else x
+                  for i, x in enumerate(counts)])
+
+
+def _vocab_hash(vocab):
+    if not isinstance(vocab, dict):
+        vocab = dict((term, i) for i, term in enumerate(vocab))
+    return hashlib.md5(repr(sorted(vocab.iteritems()))).hexdigest()
+
+
+def corpus_fingerprint(data_reader):
+    """
+    md5 of the documents of every split and of the training labels (chi-square selection depends on them)
+    """
+    md5 = hashlib.md5()
+    for split in ["train", "test", "valid"]:
+        docs = getattr(data_reader, split).x_doc
+        md5.update("{}:{}\n".format(split, len(docs)))
+        for doc in docs:
+            md5.update(repr(doc) + "\n")
+    md5.update(np.asarray(data_reader.train.y).tostring())
+    return md5.hexdigest()
+
+
+class FeatureCache:
+    """
+    ngram count matrices, keyed by a fingerprint of the corpus and the vectorizer settings
+    kept in memory, and as .npz files in cache_dir if given, so sweeps over classifier
+    settings or TFIDF never vectorize the documents twice
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.features = dict()  # (key, use_tfidf) -> (x_train, x_test, x_valid, vocabulary)
+        self.hashes = dict()  # id of a data reader or vocabulary -> (the object, its hash)
+        if cache_dir:
+            try:
+                os.stat(cache_dir)
+            except:
+                os.mkdir(cache_dir)
+
+    def _hash(self, obj, hash_function):
+        """
+        hash once per object, the object is kept so its id is not reused
+        """
+        if id(obj) not in self.hashes:
+            self.hashes[id(obj)] = (obj, hash_function(obj))
+        return self.hashes[id(obj)][1]
+
+    def key(self, data_reader, ngrams, order, max_features, vocab, use_chi_square, top_k):
+        """
+        :param data_reader: DataReader of the documents, see corpus_fingerprint
+        :param vocab: None, list of terms or dict term -> column
+        """
+        corpus = self._hash(data_reader, corpus_fingerprint)
+        vocab_hash = None
+        if vocab is not None:
+            vocab_hash = self._hash(vocab, _vocab_hash)
+            max_features = None  # ignored by CountVectorizer with a fixed vocabulary
+        return corpus, ngrams, order, max_features, vocab_hash, use_chi_square, top_k if use_chi_square else None
+
+    def get(self, key, use_tfidf=False):
+        """
+        :return: x_train, x_test, x_valid, vocabulary or None if not cached
+        """
+        if (key, use_tfidf) in self.features:
+            return self.features[(key, use_tfidf)]
+        if use_tfidf or not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+
+        with np.load(self._path(key)) as f:
+            matrices = []
+            for name in ["train", "test", "valid"]:
+                if name + "_shape" not in f:
+                    matrices.append(None)
+                    continue
+                matrices.append(csr_matrix((f[name + "_data"], f[name + "_indices"], f[name + "_indptr"]),
+                                           shape=tuple(f[name + "_shape"])))
+            vocab = dict(zip(f["vocab_terms"].tolist(), f["vocab_index"].tolist()))
+        self.features[(key, False)] = tuple(matrices) + (vocab,)
+        return self.features[(key, False)]
+
+    def put(self, key, features, use_tfidf=False, disk=True):
+        """
+        :param disk: also write counts to cache_dir
+        """
+        self.features[(key, use_tfidf)] = features
+        if use_tfidf or not disk or not self.cache_dir:
+            return
+
+        arrays = dict()
+        for name, x in zip(["train", "test", "valid"], features[:3]):
+            if x is None:
+                continue
+            x = csr_matrix(x)
+            arrays.update({name + "_data": x.data, name + "_indices": x.indices, name + "_indptr": x.indptr,
+                           name + "_shape": np.array(x.shape)})
+        vocab = features[-1]
+        terms = sorted(vocab, key=vocab.get)
+        arrays["vocab_terms"] = np.array(terms)
+        arrays["vocab_index"] = np.array([vocab[term] for term in terms], dtype=np.int64)
+        np.savez(self._path(key), **arrays)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.md5(repr(key)).hexdigest() + ".npz")
+
+
+class FeatureStack:
+    """
+    named column blocks of one data split, e.g. BOW, ngrams, topic-K-variant, stock-L
+    adding or removing a block only touches the block, the blocks are hstacked into one csr
+    when a classifier needs them, once per combination
+    """
+    def __init__(self, max_cached=4):
+        self.names = []  # block names in column order
+        self.blocks = dict()  # name -> dense or sparse matrix
+        self.max_cached = max_cached  # number of combined matrices kept
+        self.combined = []  # [(blocks, matrix)], most recent last
+
+    def add(self, name, block):
+        """
+        append a block, a block with the same name is replaced
+        """
+        self.remove(name)
+        self.names.append(name)
+        self.blocks[name] = block
+
+    def remove(self, name):
+        if name in self.blocks:
+            self.names.remove(name)
+            del self.blocks[name]
+
+    def clear(self):
+        self.names = []
+        self.blocks = dict()
+
+    def matrix(self):
+        """
+        :return: all blocks side by side, None without blocks, a single block as it is
+        """
+        blocks = [self.blocks[name] for name in self.names]
+        if len(blocks) == 0:
+            return None
+        if len(blocks) == 1:
+            return blocks[0]
+
+        for i, (cached_blocks, matrix) in enumerate(self.combined):
+            if len(cached_blocks) == len(blocks) and all(a is b for a, b in zip(cached_blocks, blocks)):
+                self.combined.append(self.combined.pop(i))
+                return matrix
+        matrix = hstack(blocks).tocsr()
+        self.combined = self.combined[-self.max_cached + 1:] if self.max_cached > 1 else []
+        self.combined.append((blocks, matrix))
+        return matrix
+
+
+BLAS_THREAD_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"]
+MMAP_MIN_BYTES = 1 << 20  # smaller matrices are simply pickled to the workers
+
+
+@contextmanager
+def limit_blas_threads(num_threads):
+    """
+    cap the BLAS/OpenMP threads of worker processes started inside the block, the variables are restored after it
+    each of n_jobs workers running a multithreaded BLAS on all cores would oversubscribe the machine
+    the current process is not capped, its BLAS read the variables when numpy was loaded
+    :param num_threads: threads per worker, None to leave the environment alone
+    """
+    saved = dict((var, os.environ.get(var)) for var in BLAS_THREAD_VARS)
+    if num_threads is not None:
+        for var in BLAS_THREAD_VARS:
+            os.environ[var] = str(num_threads)
+    try:
+        yield
+    finally:
+        for var, value in saved.iteritems():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+_temp_roots = dict()  # temp_folder -> folder of the memory mapped matrices of this process
+
+
+def temp_root(temp_folder=None):
+    """
+    one temporary folder per process (and temp_folder), removed at exit
+    """
+    if temp_folder not in _temp_roots:
+        _temp_roots[temp_folder] = tempfile.mkdtemp(prefix="baselines_", dir=temp_folder)
+        atexit.register(shutil.rmtree, _temp_roots[temp_folder], True)
+    return _temp_roots[temp_folder]
+
+
+def memmap_features(X, folder):
+    """
+    write a feature matrix to folder and map it back read-only
+    joblib passes memory mapped arrays to its workers by file name instead of pickling them
+    :param X: dense array or sparse matrix
+    :return: the same matrix backed by memory maps (csr for sparse input)
+    """
+    def _mmap(name, array):
+        path = os.path.join(folder, name + ".npy")
+        np.save(path, array)
+        return np.load(path, mmap_mode='r')
+
+    # float64 with sorted indices, the estimators would otherwise convert the read-only arrays in place
+    if not issparse(X):
+        return _mmap("x", np.asarray(X, dtype=np.float64))
+    X = csr_matrix(X, dtype=np.float64, copy=True)  # sum_duplicates sorts in place, keep the caller's matrix intact
+    X.sum_duplicates()
+    X = csr_matrix((_mmap("data", X.data), _mmap("indices", X.indices), _mmap("indptr", X.indptr)),
+                   shape=X.shape, copy=False)
+    X.has_sorted_indices = True
+    return X
+
+
+def _fit_path(estimator, X, y, sample_weight, train, test, Cs):
+    """
+    fit estimator on one fold along increasing Cs, each fit starts from the coefficients of the previous one
+    :return: test accuracy at each C
+    """
+    estimator = clone(estimator).set_params(warm_start=True)
+    x_fold, y_fold = X[train], y[train]
+    weight = None if sample_weight is None else sample_weight[train]
+    scores = []
+    for C in Cs:
+        estimator.set_params(C=C).fit(x_fold, y_fold, sample_weight=weight)
+        scores.append(estimator.score(X[test], y[test]))
+    return scores
+
+
+def path_search(estimator, X, y, param_grid, sample_weight=None, cv=3, n_jobs=1):
+    """
+    grid search over param_grid['C'] x param_grid['solver'] walking the regularization path:
+    one warm started fit sequence per (solver, fold) instead of an independent fit per grid point
+    folds, scoring and the choice of the best point follow GridSearchCV (stratified folds, fold scores
+    weighted by test size, first best point with C outer and solver inner)
+    liblinear ignores warm_start, its points are fitted from scratch
+    :return: best params, best score, mean test scores (C, solver) in grid order
+    """
+    y = np.asarray(y)
+    if sample_weight is not None:
+        sample_weight = np.asarray(sample_weight)
+    Cs = list(param_grid['C'])
+    solvers = list(param_grid['solver'])
+    folds = list(StratifiedKFold(n_splits=cv).split(X, y))
+    path = np.argsort(Cs, kind='mergesort')
+
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_path)(clone(estimator).set_params(solver=solver), X, y, sample_weight, train, test,
+                           [Cs[i] for i in path])
+        for solver in solvers for train, test in folds)
+    scores = np.array(scores, dtype=np.float64).reshape(len(solvers), len(folds), len(Cs))
+    mean = np.average(scores, axis=1, weights=[len(test) for _, test in folds])
+    mean = mean[:, np.argsort(path)].T  # back to grid order, (C, solver)
+
+    best = np.unravel_index(np.argmax(mean), mean.shape)
+    return {'C': Cs[best[0]], 'solver': solvers[best[1]]}, mean[best], mean
+
+
+SPLITS = ["train", "test", "valid"]
 Features = ["BOW", "ngrams"]
 param_grid_LR = {'C': [0.001, 0.01, 0.1, 1, 10, 100, 1000],
                  'solver': ['liblinear', 'newton-cg', 'lbfgs']}
 
-class Baselines:
+class Baselines(object):
     def __init__(self, data_reader=None, f_labels=None, vocab=None, vocab_ngrams=None,
                  vocab_size=100000, ngram_order=3, ngram_num=100000,
                  stock_today=False, stock_hist=None, f_lda=None,
-                 verbose=0, use_chi_square=False, top_k=10000000):
+                 verbose=0, use_chi_square=False, top_k=10000000, sample_weight=None, feature_cache=None,
+                 n_jobs=1, blas_threads=None, temp_folder=None, path_tuning=True):
+        """
+        :param sample_weight: weight of each training instance instead of oversampling,
+                              an array aligned with the training labels or 'balanced'
+        :param feature_cache: FeatureCache of the dataset, share one across models to vectorize only once
+        :param n_jobs: number of worker processes for the fits of tune_LR, -1 for one per core
+        :param blas_threads: BLAS threads of each worker, defaults to cores / n_jobs, this process is not capped
+        :param temp_folder: parent of the temporary folder for the memory mapped training matrix
+        :param path_tuning: tune_LR walks the C path with warm starts (path_search), False for GridSearchCV
+        """
         self.data_reader = data_reader
         self.vocab = vocab
         self.vocab_ngrams = vocab_ngrams
@@ -123,15 +409,26 @@ class Baselines:
         self.stock_hist = stock_hist # number of historical stock change to include as features (list)
         self.f_lda = f_lda # path to lda results (list)
         self.verbose = verbose
-        self.x_train = None
+        self.features = dict((split, FeatureStack()) for split in SPLITS)  # feature blocks of each split
         self.y_train = None
-        self.x_valid = None
-        self.x_test = None
         self.y_test = None
         self.predicted = None
         self.cls_model = None
         self.use_chi_square = use_chi_square
         self.top_k = top_k
+        self.feature_cache = feature_cache
+        if feature_cache is None:
+            self.feature_cache = FeatureCache()
+
+        # parallel tuning
+        self.n_jobs = n_jobs
+        self.temp_folder = temp_folder
+        self.path_tuning = path_tuning
+        self.shared = None  # (training matrix, its memory mapped copy, folder)
+        self.blas_threads = None  # applied to the workers only, see limit_blas_threads
+        if n_jobs != 1:
+            num_jobs = multiprocessing.cpu_count() if n_jobs < 0 else n_jobs
+            self.blas_threads = blas_threads or max(1, multiprocessing.cpu_count() // num_jobs)
 
         # set labels
         if data_reader is None and f_labels:
@@ -140,6 +437,10 @@ class Baselines:
             self.y_train = self.data_reader.train.y
             self.y_test = self.data_reader.test.y
 
+        self.sample_weight = sample_weight
+        if isinstance(sample_weight, str) and sample_weight == 'balanced':
+            self.sample_weight = compute_sample_weight('balanced', self.y_train)
+
     def run_ngrams(self):
         for ngrams in Features:
             for use_tfidf in [False, True]:
@@ -172,12 +473,11 @@ class Baselines:
         for stock_num in self.stock_hist:
             new_feature = "stock: t={}".format(stock_num)
             print new_feature
-            stock_num = self.add_stock_change(stock_num=stock_num, run_cls=False, reset=False)
+            self.add_stock_change(stock_num=stock_num, run_cls=False, reset=False)
             results.append(self.tune_LR(feature=new_feature))
             features.append(new_feature)
             # reset
-            self.x_train = None
-            self.x_test = None
+            self.clear_features()
             sys.stdout.flush()
 
         print '============================================\nfinal results\n' \
@@ -222,12 +522,11 @@ class Baselines:
                     for stock_num in self.stock_hist:
                         new_feature = "{}\tstock: t={}".format(feature, stock_num)
                         print new_feature
-                        stock_num = self.add_stock_change(stock_num=stock_num, run_cls=False, reset=False)
+                        stock_block = self.add_stock_change(stock_num=stock_num, run_cls=False, reset=False)
                         results.append(self.tune_LR(feature=new_feature))
                         features.append(new_feature)
                         # reset
-                        self.x_train = self.x_train[:, :-stock_num]
-                        self.x_test = self.x_test[:, :-stock_num]
+                        self.remove_features(stock_block)
                         sys.stdout.flush()
 
         print '============================================\nfinal results\n' \
@@ -264,8 +563,7 @@ class Baselines:
         print "done!"
 
         def _clear_features():
-            self.x_train = None
-            self.x_test = None
+            self.clear_features()
 
         # for each k
         print "starting tuning"
@@ -326,8 +624,7 @@ class Baselines:
         print "done!"
 
         def _clear_features():
-            self.x_train = None
-            self.x_test = None
+            self.clear_features()
 
         # for each k
         print "starting tuning"
@@ -408,8 +705,7 @@ class Baselines:
         print "done!"
 
         def _clear_features():
-            self.x_train = None
-            self.x_test = None
+            self.clear_features()
 
         # for each k
         print "starting tuning"
@@ -485,18 +781,17 @@ class Baselines:
             exit(0)
         print "done!"
 
-        def _reset_features(num):
-            self.x_train = self.x_train[:, :-num]
-            self.x_test = self.x_test[:, :-num]
+        def _reset_features(block):
+            self.remove_features(block)
 
         def _plus_stock(feature):
             # + stock change
             for stock_num in self.stock_hist:
                 new_feature = feature + "{}\tstock: t={}".format(feature, stock_num)
-                stock_num = self.add_stock_change(stock_num=stock_num, run_cls=False, reset=False)
+                stock_block = self.add_stock_change(stock_num=stock_num, run_cls=False, reset=False)
                 results.append(self.tune_LR(feature=new_feature))
                 features.append(new_feature)
-                _reset_features(num=stock_num) # reset
+                _reset_features(stock_block) # reset
                 sys.stdout.flush()
 
         for ngrams in Features:
@@ -524,23 +819,23 @@ class Baselines:
 
                         # only topic
                         new_feature = feature + " today"
-                        topic_num = self.add_lda(topic_dist=[train_lda_today, test_lda_today, feature], run_cls=False, reset=False)
+                        topic_block = self.add_lda(topic_dist=[train_lda_today, test_lda_today, feature], run_cls=False, reset=False)
                         results.append(self.tune_LR(feature=feature + " today"))
                         features.append(new_feature)
                         if self.stock_hist:
                             _plus_stock(new_feature)
-                        _reset_features(num=topic_num) # reset
+                        _reset_features(topic_block) # reset
 
                         # add
                         new_feature = feature + lda_k_hist[2]
                         train_lda = np.array([train_lda_today[i] + lda_k_hist[0][i] for i in range(train_num)])
                         test_lda = np.array([test_lda_today[i] + lda_k_hist[1][i] for i in range(test_num)])
-                        topic_num = self.add_lda(topic_dist=[train_lda, test_lda, new_feature], run_cls=False, reset=False)
+                        topic_block = self.add_lda(topic_dist=[train_lda, test_lda, new_feature], run_cls=False, reset=False)
                         results.append(self.tune_LR(feature=new_feature))
                         features.append(new_feature)
                         if self.stock_hist:
                             _plus_stock(new_feature)
-                        _reset_features(num=topic_num) # reset
+                        _reset_features(topic_block) # reset
 
                         # concatenate
                         new_feature += " (cond)"
@@ -548,12 +843,12 @@ class Baselines:
                             [np.concatenate((train_lda_today[i], lda_k_hist[0][i])) for i in range(train_num)])
                         test_lda = np.array(
                             [np.concatenate((test_lda_today[i], lda_k_hist[1][i])) for i in range(test_num)])
-                        topic_num = self.add_lda(topic_dist=[train_lda, test_lda, new_feature], run_cls=False, reset=False)
+                        topic_block = self.add_lda(topic_dist=[train_lda, test_lda, new_feature], run_cls=False, reset=False)
                         results.append(self.tune_LR(feature=new_feature))
                         features.append(new_feature)
                         if self.stock_hist:
                             _plus_stock(new_feature)
-                        _reset_features(num=topic_num)  # reset
+                        _reset_features(topic_block)  # reset
 
         print '============================================\nfinal results\n' \
               '============================================'
@@ -582,8 +877,7 @@ class Baselines:
         if run_cls:
             self.cls_LR(C=C, solver=solver)
         if reset:
-            self.x_train = None
-            self.x_test = None
+            self.clear_features()
 
     def set_ground_truth(self, f_labels):
         print "loading true labels"
@@ -596,67 +890,88 @@ class Baselines:
         :param topic_dist: content from lda feature file (list), [train, test, description]
         :param run_cls: whether to run classifer with current features
         :param reset: whether to reset feature matrix
-        :return: number of new features added
+        :return: name of the feature block added, None if reset
         """
-        topic_num = topic_dist[-1]
-        self.feature_lda(topic_dist) # add features
+        block = self.feature_lda(topic_dist) # add features
         if run_cls:
             self.cls_LR(C=C, solver=solver)
         if reset:
-            self.x_train = self.x_train[:, :-topic_num]
-            self.x_test = self.x_test[:, :-topic_num]
-            return 0
+            self.remove_features(block)
+            return None
         else:
-            return topic_num
+            return block
 
     def add_stock_change(self, stock_num=10, run_cls=True, reset=True):
         """
         :param stock_num: number of historical stock change to add
         :param run_cls: whether train classifier with current feature set
         :param reset: whether to reset feature matrix
-        :return: number of new features added
+        :return: name of the feature block added, None if reset
         """
-        self.feature_stock_change(stock_hist=stock_num) # add features
+        block = self.feature_stock_change(stock_hist=stock_num) # add features
         if run_cls:
             self.cls_LR() # train cls
         if reset:
-            self.x_train = self.x_train[:, :-stock_num]
-            self.x_test = self.x_test[:, :-stock_num]
-            return 0
+            self.remove_features(block)
+            return None
         else:
-            return stock_num
+            return block
+
+    @property
+    def x_train(self):
+        return self.features["train"].matrix()
+
+    @property
+    def x_test(self):
+        return self.features["test"].matrix()
+
+    @property
+    def x_valid(self):
+        return self.features["valid"].matrix()
+
+    def add_features(self, name, train, test, valid=None):
+        """
+        append a named feature block to every split, valid may be None without validation set
+        """
+        for split, block in zip(SPLITS, [train, test, valid]):
+            if block is not None:
+                self.features[split].add(name, block)
+        return name
+
+    def remove_features(self, name):
+        for stack in self.features.itervalues():
+            stack.remove(name)
+
+    def clear_features(self):
+        for stack in self.features.itervalues():
+            stack.clear()
 
     def feature_lda(self, topic_dist):
         """
         :param topic_dist: [train, test, description]
+        :return: name of the feature block
         """
         # add topic distributions
         print "\ttopic: {}".format(topic_dist[-1]),
-        if self.x_train is None:
-            self.x_train = topic_dist[0]
-            self.x_test = topic_dist[1]
-        else:
-            self.x_train = hstack([self.x_train, topic_dist[0]]).tocsr()
-            self.x_test = hstack([self.x_test, topic_dist[1]]).tocsr()
+        return self.add_features("topic: {}".format(topic_dist[-1]), topic_dist[0], topic_dist[1])
 
     def feature_stock_change(self, stock_hist=0):
+        """
+        :return: name of the feature block, None if nothing was added
+        """
         # add stock changes as features
         if len(self.data_reader.train.x_stock) > 0 and stock_hist > 0:
             stock_start = 1
             stock_end = stock_start + stock_hist
             if self.stock_today:
                 stock_start = 0
-            if self.x_test is None:
-                self.x_train = self.data_reader.train.x_stock[:, stock_start:stock_end]
-                self.x_test = self.data_reader.test.x_stock[:, stock_start:stock_end]
-                if len(self.data_reader.valid.y) > 0:
-                    self.x_valid = self.data_reader.valid.x_stock[:, stock_start:stock_end]
-            else:
-                self.x_train = hstack([self.x_train, self.data_reader.train.x_stock[:, stock_start:stock_end]]).tocsr()
-                self.x_test = hstack([self.x_test, self.data_reader.test.x_stock[:, stock_start:stock_end]]).tocsr()
-                if len(self.data_reader.valid.y) > 0:
-                    self.x_valid = hstack([self.x_valid,
-                                           self.data_reader.valid.x_stock[:, stock_start:stock_end]]).tocsr()
+            x_valid = None
+            if len(self.data_reader.valid.y) > 0:
+                x_valid = self.data_reader.valid.x_stock[:, stock_start:stock_end]
+            block = self.add_features("stock: t={}".format(stock_hist),
+                                      self.data_reader.train.x_stock[:, stock_start:stock_end],
+                                      self.data_reader.test.x_stock[:, stock_start:stock_end],
+                                      x_valid)
             """
             ##### debug:NAN problem ######
             self.x_train = np.array(self.x_train.todense())
@@ -665,70 +980,110 @@ class Baselines:
             print np.argwhere(np.isnan(self.data_reader.train.x_stock))
             print np.all(np.isfinite(self.x_train))
             """
+            return block
 
     def feature_BOW(self, use_tfidf=False):
-        bow_transformer = CountVectorizer(vocabulary=self.vocab,
-                                          max_features=self.vocab_size)
-        if self.use_chi_square is False:
-            self.x_train = bow_transformer.fit_transform(self.data_reader.train.x_doc)
-            self.vocab = bow_transformer.vocabulary_
-        else:
-            # feature selection over BOW
-            term_doc = bow_transformer.fit_transform(self.data_reader.train.x_doc)
-            chi_square = CustomSelectKBest(score_func=chi2, k=self.top_k)
-            self.x_train = chi_square.fit_transform(term_doc, self.data_reader.train.y)
-            self.vocab = chi_square.transform_vocabulary(bow_transformer.vocabulary_)
-
-        bow_transformer_test = CountVectorizer(vocabulary=self.vocab)
-        self.x_test = bow_transformer_test.fit_transform(self.data_reader.test.x_doc)
-        if len(self.data_reader.valid.y) > 0:
-            self.x_valid = bow_transformer_test.fit_transform(self.data_reader.valid.x_doc)
-        if use_tfidf:
-            tfidf_transformer = TfidfTransformer()
-            self.x_train = tfidf_transformer.fit_transform(self.x_train)
-            self.x_test = tfidf_transformer.fit_transform(self.x_test)
-            if len(self.data_reader.valid.y) > 0:
-                self.x_valid = tfidf_transformer.fit_transform(self.x_valid)
+        self.vocab = self._ngram_features("BOW", self.vocab, self.vocab_size, 1, use_tfidf)
 
     def feature_ngrams(self, use_tfidf=False):
-        ngrams_transfomer = CountVectorizer(vocabulary=self.vocab_ngrams,
-                                            max_features=self.ngrams_num,
-                                            ngram_range=(1, self.ngrams_order))
+        self.vocab_ngrams = self._ngram_features("ngrams", self.vocab_ngrams, self.ngrams_num, self.ngrams_order,
+                                                 use_tfidf)
 
+    def _ngram_features(self, ngrams, vocab, max_features, order, use_tfidf):
+        """
+        set x_train, x_test, x_valid to ngram counts (or their TFIDF), vectorized once per setting
+        :return: vocabulary of the features
+        """
+        key = self.feature_cache.key(self.data_reader, ngrams, order, max_features, vocab,
+                                     self.use_chi_square, self.top_k)
+        counts = self.feature_cache.get(key)
+        if counts is None:
+            counts = self._count_ngrams(vocab, max_features, order)
+            self.feature_cache.put(key, counts)
+        # later calls pass the fitted vocabulary
+        self.feature_cache.put(self.feature_cache.key(self.data_reader, ngrams, order, max_features, counts[-1],
+                                                      self.use_chi_square, self.top_k), counts, disk=False)
+
+        features = counts
+        if use_tfidf:
+            features = self.feature_cache.get(key, use_tfidf=True)
+            if features is None:
+                features = tfidf_features(counts)
+                self.feature_cache.put(key, features, use_tfidf=True, disk=False)
+        self.clear_features()
+        self.add_features(ngrams, *features[:3])
+        return features[-1]
+
+    def _count_ngrams(self, vocab, max_features, order):
+        """
+        :return: x_train, x_test, x_valid (None without validation set), vocabulary
+        """
+        ngram_range = (1, order)
+        transformer = CountVectorizer(vocabulary=vocab,
+                                      max_features=max_features,
+                                      ngram_range=ngram_range)
         if self.use_chi_square is False:
-            self.x_train = ngrams_transfomer.fit_transform(self.data_reader.train.x_doc)
-            self.vocab_ngrams = ngrams_transfomer.vocabulary_
+            x_train = transformer.fit_transform(self.data_reader.train.x_doc)
+            vocab = transformer.vocabulary_
         else:
-            term_doc = ngrams_transfomer.fit_transform(self.data_reader.train.x_doc)
+            # feature selection over ngrams
+            term_doc = transformer.fit_transform(self.data_reader.train.x_doc)
             chi_square = CustomSelectKBest(score_func=chi2, k=self.top_k)
-            self.x_train = chi_square.fit_transform(term_doc, self.data_reader.train.y)
-            self.vocab_ngrams = chi_square.transform_vocabulary(ngrams_transfomer.vocabulary_)
+            x_train = chi_square.fit_transform(term_doc, self.data_reader.train.y)
+            vocab = chi_square.transform_vocabulary(transformer.vocabulary_)
 
-        ngrams_transfomer_test = CountVectorizer(vocabulary=self.vocab_ngrams)
-        self.x_test = ngrams_transfomer_test.fit_transform(self.data_reader.test.x_doc)
+        transformer_test = CountVectorizer(vocabulary=vocab)
+        x_test = transformer_test.fit_transform(self.data_reader.test.x_doc)
+        x_valid = None
         if len(self.data_reader.valid.y) > 0:
-            self.x_valid = ngrams_transfomer_test.fit_transform(self.data_reader.valid.x_doc)
-        if use_tfidf:
-            tfidf_transformer = TfidfTransformer()
-            self.x_train = tfidf_transformer.fit_transform(self.x_train)
-            self.x_test = tfidf_transformer.fit_transform(self.x_test)
-            if len(self.data_reader.valid.y) > 0:
-                self.x_valid = tfidf_transformer.fit_transform(self.x_valid)
+            x_valid = transformer_test.fit_transform(self.data_reader.valid.x_doc)
+        return x_train, x_test, x_valid, vocab
 
     def cls_LR(self, C=1, solver='lbfgs', max_iter=500):
         self.cls_model = LogisticRegression(C=C, solver=solver, max_iter=max_iter, verbose=self.verbose)
         print '\t[feature num] {}'.format(self.x_train.shape[1]),
-        self.cls_model.fit(self.x_train, self.y_train)
+        self.cls_model.fit(self.x_train, self.y_train, sample_weight=self.sample_weight)
         self.predicted = self.cls_model.predict(self.x_test)
         accu_train = self.cls_model.score(self.x_train, self.y_train)
         accu = accuracy_score(self.y_test, self.predicted)
         print "\t[Accuracy] train:", accu_train, "\ttest:", accu
 
+    def shared_x_train(self):
+        """
+        :return: x_train, memory mapped once per feature combination if fits run in worker processes
+        """
+        x_train = self.x_train
+        if self.n_jobs == 1:
+            return x_train
+        nbytes = sum(a.nbytes for a in [x_train.data, x_train.indices, x_train.indptr]) \
+            if issparse(x_train) else np.asarray(x_train).nbytes
+        if nbytes < MMAP_MIN_BYTES:
+            return x_train
+        if self.shared is None or self.shared[0] is not x_train:
+            folder = tempfile.mkdtemp(dir=temp_root(self.temp_folder))
+            if self.shared is not None:
+                shutil.rmtree(self.shared[2], True)
+            self.shared = (x_train, memmap_features(x_train, folder), folder)
+        return self.shared[1]
+
     def tune_LR(self, feature=None):
-        cv_model = GridSearchCV(LogisticRegression(penalty='l2', max_iter=500),
-                                param_grid=param_grid_LR,
-                                verbose=5, return_train_score=True)
-        cv_model.fit(self.x_train, self.y_train)
+        estimator = LogisticRegression(penalty='l2', max_iter=500)
+        x_train = self.shared_x_train()
+        if self.path_tuning:
+            with limit_blas_threads(self.blas_threads):
+                best_params, _, _ = path_search(estimator, x_train, self.y_train, param_grid_LR,
+                                                sample_weight=self.sample_weight, n_jobs=self.n_jobs)
+            best_model = clone(estimator).set_params(**best_params)
+            best_model.fit(self.x_train, self.y_train, sample_weight=self.sample_weight)
+        else:
+            cv_model = GridSearchCV(estimator, param_grid=param_grid_LR,
+                                    verbose=5, return_train_score=True, n_jobs=self.n_jobs)
+            with limit_blas_threads(self.blas_threads):
+                if self.sample_weight is None:
+                    cv_model.fit(x_train, self.y_train)
+                else:
+                    cv_model.fit(x_train, self.y_train, sample_weight=self.sample_weight)
+            best_params, best_model = cv_model.best_params_, cv_model.best_estimator_
 
         """
         print "\n======================================"
@@ -746,17 +1101,17 @@ class Baselines:
         print "\n================================================================"
         if feature:
             print "[Features] {}".format(feature)
-        print "[Best model] {}".format(cv_model.best_params_)
+        print "[Best model] {}".format(best_params)
         if self.vocab:
             print "[Vocab] {}".format(len(self.vocab))
         if self.vocab_ngrams:
             print "[N-grams (N<=2)] {}".format(len(self.vocab_ngrams))
         print "[Size] train:{}\ttest:{}".format(self.x_train.shape, self.x_test.shape)
-        accu_train = cv_model.score(self.x_train, self.y_train)
-        accu = cv_model.score(self.x_test, self.y_test)
+        accu_train = best_model.score(self.x_train, self.y_train)
+        accu = best_model.score(self.x_test, self.y_test)
         print "[Accuracy] train:{}\ttest:{}".format(accu_train, accu)
         print "================================================================\n"
-        return (accu, accu_train, cv_model.best_estimator_)
+        return (accu, accu_train, best_model)
 
     def get_top_features(self, N=30, feature="BOW"):
         # reversed dictionary (idx -> term)
@@ -922,6 +1277,7 @@ if __name__ == "__main__":
     data_reader = DataReader(dataset=f_dataset_docs)
 
     vocab_top_k = [30]  # feature selection
+    feature_cache = FeatureCache()  # shared by the models of the sweep
     for top_k in vocab_top_k:
         print 'performing classification for vocabulary size: {}'.format(top_k)
         with open(unigram_mi_scores) as scores:
@@ -933,7 +1289,7 @@ if __name__ == "__main__":
         myModel = Baselines(data_reader=data_reader, ngram_num=1000000, ngram_order=2,
                             f_lda=f_lda,
                             stock_today=False, stock_hist=stock_hist,
-                            verbose=0, vocab=vocab, vocab_ngrams=vocab_ngrams)
+                            verbose=0, vocab=vocab, vocab_ngrams=vocab_ngrams, feature_cache=feature_cache)
         myModel.sig_test_ngram_vs_all()
 
 
@@ -1083,6 +1439,7 @@ if __name__ == "__main__":
     data_reader = DataReader(dataset=f_dataset_docs)
 
     vocab_top_k = [30]  # feature selection
+    feature_cache = FeatureCache()  # shared by the models of the sweep
     for top_k in vocab_top_k:
         print 'performing classification for vocabulary size: {}'.format(top_k)
         with open(unigram_mi_scores) as scores:
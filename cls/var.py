@@ -23,15 +23,23 @@ class DataReader:
         y_train_labels = []
         y_test_labels = []
 
+        # {company, date, doc_idx, price, prices of the L previous days, label, train(0)/test(1)}
+        # L is read from the '#num_previous_days=L' header, or from the line length
+        num_lags = None
         for line in open(f_corpus_labels_stock_price):
+            if line.startswith('#'):
+                num_lags = int(line.strip().split('=')[-1])
+                continue
             line = line.strip().split(',')
+            if num_lags is None:
+                num_lags = len(line) - 6
             line[-1] = int(line[-1])
             if line[-1] == 0:
-                x_train.append(self.parse_float(line[-22:-2]))
+                x_train.append(self.parse_float(line[-2 - num_lags:-2]))
                 y_train_price.append(float(line[3]))
                 y_train_labels.append(int(line[-2]))
             if line[-1] == 1:
-                x_test.append(self.parse_float(line[-22:-2]))
+                x_test.append(self.parse_float(line[-2 - num_lags:-2]))
                 y_test_price.append(float(line[3]))
                 y_test_labels.append(int(line[-2]))
 
@@ -0,0 +1,40 @@
+"""
+class balancing by row index
+oversampling returns row indexes into the dataset instead of copies of the rows,
+balanced sample weights keep every row exactly once
+"""
+
+import numpy as np
+
+
+def oversample_index(labels, classes=None, size=None, rng=np.random):
+    """
+    grow every class up to size rows by drawing duplicates with replacement
+    :param labels: label of each row
+    :param classes: classes to keep, in output order, defaults to the sorted unique labels
+    :param size: rows per class, defaults to the largest class, classes above size are kept whole
+    :param rng: np.random or a seeded np.random.RandomState
+    :return: row indexes grouped by class, all rows of a class followed by its duplicates
+    """
+    labels = np.asarray(labels)
+    if classes is None:
+        classes = np.unique(labels)
+    rows = [np.flatnonzero(labels == c) for c in classes]
+    if size is None:
+        size = max(len(r) for r in rows)
+
+    index = []
+    for r in rows:
+        index.append(r)
+        if 0 < len(r) < size:
+            index.append(r[rng.randint(0, len(r), size - len(r))])
+    return np.concatenate(index) if index else np.zeros(0, dtype=np.int64)
+
+
+def balanced_weights(labels):
+    """
+    sample weights n_samples / (n_classes * class count), as sklearn's class_weight='balanced'
+    every class then carries the same total weight
+    """
+    classes, codes, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    return len(codes) / (len(classes) * counts.astype(np.float64))[codes]
@@ -15,6 +15,7 @@ from operator import itemgetter
 import cPickle as pkl
 
 from clean_str import clean_str
+from stats_stock import parse_metadata_header
 
 def extract_docs(path_in, path_out):
     """
@@ -284,7 +285,8 @@ class DataProcessor:
         self.test_idx = []  # doc_idx for test
         self.train_labels = []
         self.test_labels = []
-        self.train_stock = [] # each element is a list of stock change (today, prev 20 days)
+        self.num_lags = None # number of previous days L in the meta data
+        self.train_stock = [] # each element is a list of stock change (today, prev L days)
         self.test_stock = []
         self.train_lda_hist_idx = [] # each element is a list of doc_idx for topic history
         self.test_lda_hist_idx = []
@@ -413,9 +415,11 @@ class DataProcessor:
         """
         :param f_meta_data: meta data, comma separated
                             {company, date, doc_idx (line number of doc in corpus, starting 0),
-                            today's stock change, previous 20 days' stock changes,
-                            previous 20 day's doc_idx (-1 if non-exist)
+                            today's stock change, previous L days' stock changes,
+                            previous L day's doc_idx (-1 if non-exist)
                             label, train(0)/test(1)}
+                            L is read from the header line (see stats_stock.metadata_header),
+                            files without header are taken to have 2L+6 fields per line
         """
         print "Loading metadata...",
         self.reset_idx()
@@ -423,21 +427,30 @@ class DataProcessor:
         with open(f_meta_data, "r") as f:
             meta_data = f.readlines()
 
+        self.num_lags = None
+        for line in meta_data:
+            if line.startswith("#"):
+                self.num_lags = parse_metadata_header(line)
+        meta_data = [line for line in meta_data if not line.startswith("#")]
+        if self.num_lags is None and len(meta_data) > 0:
+            self.num_lags = (len(meta_data[0].strip().split(",")) - 6) / 2
+        num_lags = self.num_lags
+
         for lidx, meta_line in enumerate(meta_data):
             meta_line = meta_line.strip().split(",")
-            assert len(meta_line) == 46, \
+            assert len(meta_line) == 2 * num_lags + 6, \
                 "invalid meta data! line {}, length {}".format(lidx+1, len(meta_line))
 
             # stock changes
-            stock_hist = np.array([float(s) for s in meta_line[3:24]]) # today, 20 previous days
+            stock_hist = np.array([float(s) for s in meta_line[3:4 + num_lags]]) # today, L previous days
             pos = np.argwhere(np.isnan(stock_hist))
             stock_hist[pos] = 0.
 
             # lda hist
-            lda_hist = [int(s) for s in meta_line[-3:-23:-1]] # 20 previous days
+            lda_hist = [int(s) for s in meta_line[-3:-3 - num_lags:-1]] # L previous days
 
             # topic change
-            lda_change = [int(meta_line[-22])]  # yesterday only
+            lda_change = [int(meta_line[-2 - num_lags])]  # yesterday only
 
             # stock label
             label = int(meta_line[-2])
@@ -1,68 +1,50 @@
 import numpy as np
+import pandas as pd
 import os
-import random
-from datetime import date
+from multiprocessing import Pool
+from balancing import oversample_index, balanced_weights
+from dataset_io import write_dataset, binary_path, read_sparse_dataset, BINARY_SUFFIX
 
-class DataPoint(object):
 
-    def __init__(self, label, values, index):
-        self.label = label
-        self.values = values
-        self.index = index
-
-
-def to_date(string):
-    split = string.split('-')
-    return date(int(split[0]), int(split[1]), int(split[2]))
+def dataset_file(path, binary=False):
+    '''
+    :return: Path of the binary dataset written for path if binary, path otherwise
+    '''
+    if binary:
+        return binary_path(path)
+    return path
 
 
 def read_dataset(path):
     '''
-    :param path:  Path to the dataset
-    :return: A list of DataPoint
+    :param path:  Path to the dataset, libsvm text or binary dataset directory
+    :return: A SparseDataset, rows are selected by index arrays
     '''
-    f = open(path, 'r')
-
-    dataset = []
-
-    for i, line in enumerate(f.readlines()):
-        line = line.replace('\n', '')
-        splits = line.split()
-        label = float(splits[0])
-        values = dict()
-        for split in splits[1:]:
-            feature = int(split.split(':')[0])
-            value = float(split.split(':')[1])
-            values[feature] = value
-        dataset.append(DataPoint(label, values, i))
+    return read_sparse_dataset(path)
 
-    return dataset
 
-
-def sample_balanced_dataset(dataset, shuffle=True, sample=True):
+def sample_balanced_dataset(dataset, shuffle=True, sample=True, rng=np.random):
     '''
     Sample data set that has as many positive instances
      as it has negative instances
-    '''
 
-    positive = []
-    negative = []
+    :param rng: np.random or a seeded np.random.RandomState
+    :return: Row indexes of the positive and of the negative instances
+    '''
+    labels = dataset.labels
+    if not np.all((labels == 1) | (labels == 0)):
+        print('datapoint label incorrect')
+        exit(1)
 
-    for datapoint in dataset:
-        if datapoint.label == 1:
-            positive.append(datapoint)
-        elif datapoint.label == 0:
-            negative.append(datapoint)
-        else:
-            print('datapoint label incorrect')
-            exit(1)
+    positive = np.flatnonzero(labels == 1)
+    negative = np.flatnonzero(labels == 0)
 
     if shuffle:
-        random.shuffle(positive)
-        random.shuffle(negative)
+        rng.shuffle(positive)
+        rng.shuffle(negative)
 
     if sample:
-        return positive, np.random.choice(negative, len(positive), True)
+        return positive, rng.choice(negative, len(positive), True)
     else:
         return positive, negative
 
@@ -71,9 +53,11 @@ def k_fold_datasets(positive, negative, k):
     '''
     Returns k datasets for train and test, corresponding to
     k folds each having the same amount of negative and positive samples
-    '''
-
 
+    :param positive: Row indexes of the positive instances
+    :param negative: Row indexes of the negative instances
+    :return: Row indexes of the train and the test set of every fold
+    '''
     train = [0] * k
     test = [0] * k
 
@@ -81,62 +65,91 @@ def k_fold_datasets(positive, negative, k):
     folds_neg = np.array_split(negative, k)
 
     for i in range(k):
-        test[i] = folds_pos[i].tolist()
-        test[i].extend(folds_neg[i].tolist())
-        train[i] = list()
-        for j in range(k):
-            if i != j:
-                train[i].extend(folds_pos[j].tolist())
-                train[i].extend(folds_neg[j].tolist())
+        test[i] = np.concatenate([folds_pos[i], folds_neg[i]])
+        train[i] = np.concatenate([fold for j in range(k) if i != j for fold in (folds_pos[j], folds_neg[j])])
 
     return train, test
 
 
-def train_test_to_file(train, test, train_out, test_out):
-    tro = open(train_out, 'w')
-    teo = open(test_out, 'w')
+def train_test_to_file(dataset, train, test, train_out, test_out, binary=False, weighted=False):
+    valid_to_file(dataset, train, train_out, binary, weighted)
+    valid_to_file(dataset, test, test_out, binary, weighted)
 
-    for datapoint in train:
-        tro.write('{} '.format(datapoint.label))
-        for feature, value in datapoint.values.items():
-            tro.write('{}:{} '.format(feature, value))
-        tro.write('\n')
-    tro.close()
 
-    for datapoint in test:
-        teo.write('{} '.format(datapoint.label))
-        for feature, value in datapoint.values.items():
-            teo.write('{}:{} '.format(feature, value))
-        teo.write('\n')
-    teo.close()
-
-def valid_to_file(valid, valid_out):
-    tvo = open(valid_out, "w")
-    for datapoint in valid:
-        tvo.write('{} '.format(datapoint.label))
-        for feature, value in datapoint.values.items():
-            tvo.write('{}:{} '.format(feature, value))
-        tvo.write('\n')
-    tvo.close()
+def valid_to_file(dataset, valid, valid_out, binary=False, weighted=False):
+    '''
+    :param dataset: A SparseDataset
+    :param valid: Row indexes of dataset to write
+    :param weighted: Also write class-balanced sample weights of the rows
+    '''
+    rows = np.asarray(valid, dtype=np.int64)
+    weight = balanced_weights(dataset.labels[rows]) if weighted and len(rows) > 0 else None
+    write_dataset(valid_out, dataset.features[rows], dataset.labels[rows], index=dataset.index[rows],
+                  binary=binary, weight=weight)
 
 
 def generate_validation(positive, negative, k=6):
     folds_pos = np.array_split(positive, k)
     folds_neg = np.array_split(negative, k)
-    valid = []
-    other = []
 
-    valid = folds_pos[k-1].tolist()
-    valid.extend(folds_neg[k-1].tolist())
-
-    for i in range(k-1):
-        other.extend(folds_pos[i].tolist())
-        other.extend(folds_neg[i].tolist())
+    valid = np.concatenate([folds_pos[k-1], folds_neg[k-1]])
+    other = np.concatenate([fold for i in range(k-1) for fold in (folds_pos[i], folds_neg[i])])
 
     return valid, other
 
 
-def generate_dataset(num_folds, st, path):
+def fold_manifest_file(f_other):
+    return f_other + ".folds.npz"
+
+
+def write_fold_manifest(dataset, num_folds, f_manifest, seed=0):
+    '''
+    Store the row indexes of num_folds repetitions of num_folds-fold cross-validation
+
+    :param dataset: A SparseDataset
+    :param f_manifest: Output .npz, arrays train_s{k}_k{i} and test_s{k}_k{i}
+    :param seed: Seed of the balanced sampling, the same seed gives the same folds
+    '''
+    rng = np.random.RandomState(seed)
+    folds = dict()
+
+    for k in range(num_folds):
+        pos, neg = sample_balanced_dataset(dataset, sample=True, rng=rng)  # balanced sampling
+        folds_tr, folds_te = k_fold_datasets(pos, neg, num_folds)
+        for i in range(num_folds):
+            folds['train_s{}_k{}'.format(k, i)] = folds_tr[i]
+            folds['test_s{}_k{}'.format(k, i)] = folds_te[i]
+
+    np.savez(f_manifest, num_folds=num_folds, seed=seed, **folds)
+
+
+def load_folds(f_other, binary=False, mmap=True):
+    '''
+    Cross-validation folds of a dataset written by generate_dataset(..., manifest=True)
+
+    :param f_other: Path to the .data file, as in generate_dataset
+    :param binary: f_other was written as a binary dataset
+    :param mmap: Memory map the binary dataset, folds then read only their rows
+    :return: Generator of (k, i, train, test), train and test are SparseDatasets
+    '''
+    data = read_sparse_dataset(dataset_file(f_other, binary), mmap=mmap)
+    manifest = np.load(fold_manifest_file(f_other))
+    num_folds = int(manifest['num_folds'])
+
+    for k in range(num_folds):
+        for i in range(num_folds):
+            yield k, i, data.subset(manifest['train_s{}_k{}'.format(k, i)]), \
+                data.subset(manifest['test_s{}_k{}'.format(k, i)])
+
+
+def generate_dataset(num_folds, st, path, binary=False, manifest=False, seed=0):
+    '''
+    Validation set and num_folds repetitions of num_folds-fold cross-validation for every file in path + st
+
+    :param manifest: Only store the fold row indexes in .data.folds.npz (see load_folds)
+                     instead of writing every train and test file
+    :param seed: Seed of the fold manifest
+    '''
     path_data = path + st + '/'
     path_obj = path + 'cross_validation/' + st + '/'
     try:
@@ -148,6 +161,7 @@ def generate_dataset(num_folds, st, path):
         print "generation training data for", data_file
         file_name = data_file.replace(".csv", "")
         file_name = file_name.replace(".txt", "")
+        file_name = file_name.replace(BINARY_SUFFIX, "")
         path_out = path_obj + file_name + "/"
         try:
             os.stat(path_out)
@@ -158,125 +172,154 @@ def generate_dataset(num_folds, st, path):
 
         # create validation set if not exist
         try:
-            os.stat(f_valid)
-            os.stat(f_other)
+            os.stat(dataset_file(f_valid, binary))
+            os.stat(dataset_file(f_other, binary))
         except:
             data = read_dataset(path_data + data_file)
             pos, neg = sample_balanced_dataset(data, sample=False)
             valid, other = generate_validation(positive=pos, negative=neg, k=6)
-            valid_to_file(valid, f_valid)
-            valid_to_file(other, f_other)
+            valid_to_file(data, valid, f_valid, binary)
+            valid_to_file(data, other, f_other, binary)
 
         # do cross-validation on other (validation excluded)
         # repeat num_folds times
+        data = read_dataset(dataset_file(f_other, binary))
+
+        if manifest:
+            write_fold_manifest(data, num_folds, fold_manifest_file(f_other), seed)
+            continue
+
         for k in range(num_folds):
             path_cross = path_out + str(k) + "/"
             try:
                 os.stat(path_cross)
             except:
                 os.mkdir(path_cross)
-            data = read_dataset(f_other)
             pos, neg = sample_balanced_dataset(data, sample=True)  # balanced sampling
             folds_tr, folds_te = k_fold_datasets(pos, neg, num_folds)
 
             for i in range(num_folds):
-                train_test_to_file(folds_tr[i], folds_te[i],
+                train_test_to_file(data, folds_tr[i], folds_te[i],
                                    path_cross + file_name + '.train.s{}.k{}'.format(k, i),
-                                   path_cross + file_name + '.test.s{}.k{}'.format(k, i))
+                                   path_cross + file_name + '.test.s{}.k{}'.format(k, i),
+                                   binary=binary)
 
 
-def oversample(dataset):
-    pos = []
-    neg = []
-    neu = []
+def oversample(dataset, rows):
+    '''
+    Oversample the positive and negative instances up to the number of neutral instances
 
-    for datapoint in dataset:
-        if datapoint.label == 1:
-            pos.append(datapoint)
-        elif datapoint.label == -1:
-            neg.append(datapoint)
-        elif datapoint.label == 0:
-            neu.append(datapoint)
-        else:
-            print "ERROR: No label for datapoint: ", datapoint
+    :param dataset: A SparseDataset
+    :param rows: Row indexes of dataset to oversample
+    :return: Row indexes, positive then negative then neutral
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    labels = dataset.labels[rows]
 
-    while len(pos) < len(neu):
-        pos.append(pos[random.randint(0, len(pos)-1)])
+    for row in rows[(labels != 1) & (labels != -1) & (labels != 0)]:
+        print "ERROR: No label for datapoint: ", row
 
-    while len(neg) < len(neu):
-        neg.append(neg[random.randint(0, len(neg)-1)])
+    return rows[oversample_index(labels, classes=[1, -1, 0], size=np.sum(labels == 0))]
 
-    # add all datapoints together into 'pos'
-    pos.extend(neg)
-    pos.extend(neu)
 
-    return pos
+def load_split(corpus_split):
+    '''
+    Load the dataset column (0 train, 1 test, 2 validation) of a corpus split file as int8
 
+    :param corpus_split: Path to corpus split file (Company, Date, Id, Open, Close, Label, Dataset)
+    :return: array of int8, one per line of corpus_split
+    '''
+    return pd.read_csv(corpus_split, header=None, usecols=[6], dtype=np.int8).values[:, 0]
 
-def generate_dataset_split(batch_name, features_root, corpus_split, oversampling=False):
-    path_data = features_root + batch_name + '/'
-    path_time = features_root + 'time/'
-    path_obj = path_time + batch_name + '/'
 
+_split_info = None  # dataset column of the corpus split, shared with forked workers
+
+
+def split_file(data_file, path_data, path_obj, split_info, oversampling=False, binary=False):
+    '''
+    Write the train, test and validation sets of one feature file, see generate_dataset_split
+
+    :param split_info: Dataset of every corpus line, from load_split
+    '''
+    print "generation training data for", data_file
+    file_name = data_file.replace(".csv", "")
+    file_name = file_name.replace(".txt", "")
+    file_name = file_name.replace(BINARY_SUFFIX, "")
+    path_out = path_obj + file_name + "/"
 
     try:
-        os.stat(path_time)
+        os.stat(path_out)
     except:
-        os.mkdir(path_time)
+        os.mkdir(path_out)
+
+    data = read_dataset(path_data + data_file)
 
+    split = split_info[data.index]
+    train = np.flatnonzero(split == 0)
+    test = np.flatnonzero(split == 1)
+    valid = np.flatnonzero(split == 2)
+
+    for row in np.flatnonzero((split < 0) | (split > 2)):
+        print "ERROR: No dataset could be found for datapoint: {}".format(data.index[row])
+
+    weighted = oversampling == 'weights'
+    if oversampling and not weighted:
+        train = oversample(data, train)
+        test = oversample(data, test)
+        valid = oversample(data, valid)
+
+    f_valid = path_out + file_name + ".valid"
     try:
-        os.stat(path_obj)
+        os.stat(dataset_file(f_valid, binary))
     except:
-        os.mkdir(path_obj)
+        valid_to_file(data, valid, f_valid, binary, weighted)
 
-    with open(corpus_split, "r") as f:
-        split_info = f.readlines()
+    train_test_to_file(dataset=data, train=train, test=test,
+                       train_out=path_out + file_name + '.train',
+                       test_out=path_out + file_name + '.test',
+                       binary=binary, weighted=weighted)
 
 
+def _split_file(args):
+    data_file, path_data, path_obj, oversampling, binary = args
+    split_file(data_file, path_data, path_obj, _split_info, oversampling, binary)
 
-    for data_file in os.listdir(path_data):
-        print "generation training data for", data_file
-        file_name = data_file.replace(".csv", "")
-        file_name = file_name.replace(".txt", "")
-        path_out = path_obj + file_name + "/"
-
-        try:
-            os.stat(path_out)
-        except:
-            os.mkdir(path_out)
 
+def generate_dataset_split(batch_name, features_root, corpus_split, oversampling=False, binary=False, processes=None):
+    '''
+    :param oversampling: True to oversample the minority classes (rows are written repeatedly),
+                         'weights' to write every row once with class-balanced sample weights
+    :param processes: Number of worker processes, each takes one feature file at a time
+    '''
+    path_data = features_root + batch_name + '/'
+    path_time = features_root + 'time/'
+    path_obj = path_time + batch_name + '/'
 
-        data = read_dataset(path_data + data_file)
 
-        train = []
-        test = []
-        valid = []
+    try:
+        os.stat(path_time)
+    except:
+        os.mkdir(path_time)
 
-        for datapoint in data:
-            dataset = int(split_info[datapoint.index].strip().split(',')[6])
-            if dataset == 0:
-                train.append(datapoint)
-            elif dataset == 1:
-                test.append(datapoint)
-            elif dataset == 2:
-                valid.append(datapoint)
-            else:
-                print "ERROR: No dataset could be found for datapoint: {}".format(str(datapoint))
+    try:
+        os.stat(path_obj)
+    except:
+        os.mkdir(path_obj)
 
-        if oversampling:
-            train = oversample(train)
-            test = oversample(test)
-            valid = oversample(valid)
+    global _split_info
+    _split_info = load_split(corpus_split)  # parse once before the workers fork
 
-        f_valid = path_out + file_name + ".valid"
-        try:
-            os.stat(f_valid)
-        except:
-            valid_to_file(valid, f_valid)
+    tasks = [(data_file, path_data, path_obj, oversampling, binary)
+             for data_file in os.listdir(path_data)]
 
-        train_test_to_file(train=train, test=test,
-                           train_out=path_out + file_name + '.train',
-                           test_out=path_out + file_name + '.test')
+    if processes == 1:
+        map(_split_file, tasks)
+    else:
+        # reseed every worker, forked workers would otherwise oversample with the same draws
+        pool = Pool(processes, initializer=np.random.seed)
+        pool.map(_split_file, tasks)
+        pool.close()
+        pool.join()
 
 
 
@@ -304,6 +347,19 @@ if __name__ == '__main__':
 
     '''
 
+    ###### Five-fold cross-validation, fold indexes only #####
+    '''
+    num_folds = 5
+    path = '../data/features/'
+    st = "topic_hist_d0.9_w1"
+    generate_dataset(num_folds=num_folds, st=st, path=path, binary=True, manifest=True)
+
+    for data_file in os.listdir(path + 'cross_validation/' + st + '/'):
+        f_other = path + 'cross_validation/' + st + '/' + data_file + '/' + data_file + '.data'
+        for k, i, train, test in load_folds(f_other, binary=True):
+            print k, i, len(train), len(test)
+    '''
+
     ###### Time based training and testing ######
     '''
     path = '../data/features/'
@@ -1,17 +1,25 @@
+import os
 import random
 import numpy as np
 from datetime import date
-from data_separate import to_date
+from balancing import oversample_index, balanced_weights
+from dataset_io import save_weight, weight_path
+from trading_calendar import parse_days, day_number
 
 def separate_train_test_validation(split_date, perc_val, f_label, f_split, balance=False):
     '''
     Format:
     Company, Date, Id, Open, Close, Label, Dataset
+    Header lines (starting with '#') are copied to the top of f_split.
 
     :param split_date: Date for splitting training and testing
     :param perc_val: Percentage value (< 1) of testing data that will be used as validation set
     :param f_label: Path to croups label file
     :param f_split: Output
+    :param balance: True to oversample label 0 and 1 of every set (lines are written repeatedly),
+                    'weights' to write every line of label 0 and 1 once and save class-balanced
+                    sample weights of its records (header lines excluded) next to f_split,
+                    see dataset_io.weight_path
     '''
 
     print "Splitting dataset on date: {}...".format(str(split_date))
@@ -20,15 +28,12 @@ def separate_train_test_validation(split_date, perc_val, f_label, f_split, balan
         lines = f.readlines()
 
     fout = open(f_split, "w")
+    fout.writelines([line for line in lines if line.startswith('#')])
+    lines = [line for line in lines if not line.startswith('#')]
 
-    train = []
-    test = []
-
-    for line in lines:
-        if to_date(line.split(',')[1]) <= split_date:
-            train.append(line)
-        else:
-            test.append(line)
+    in_train = parse_days([line.split(',')[1] for line in lines]) <= day_number(split_date)
+    train = [line for line, t in zip(lines, in_train) if t]
+    test = [line for line, t in zip(lines, in_train) if not t]
 
     validation = []
 
@@ -37,7 +42,11 @@ def separate_train_test_validation(split_date, perc_val, f_label, f_split, balan
     for i in range(int(len(train) * perc_val)):
         validation.append(train.pop())
 
-    if balance:
+    if balance == 'weights':
+        train, test, validation = [balance_weights_binary(lines) for lines in [train, test, validation]]
+        weights = np.concatenate([train[1], test[1], validation[1]])
+        train, test, validation = train[0], test[0], validation[0]
+    elif balance:
         train = balance_dataset_binary(train)
         test = balance_dataset_binary(test)
         if len(validation) > 0:
@@ -55,6 +64,12 @@ def separate_train_test_validation(split_date, perc_val, f_label, f_split, balan
 
     for line in validation:
         fout.write("{},{}\n".format(line.strip(), 2))
+    fout.close()
+
+    if balance == 'weights':
+        save_weight(f_split, weights)
+    elif os.path.exists(weight_path(f_split)):
+        os.remove(weight_path(f_split))
 
     total = 0.0 + num_val + num_test + num_train
 
@@ -62,29 +77,87 @@ def separate_train_test_validation(split_date, perc_val, f_label, f_split, balan
         .format(num_train / total, num_test / total, num_val / total)
 
 
-def split_by_label(dataset):
-    label_split = dict()
+def balance_dataset_binary(dataset):
+    '''
+    Oversample the smaller of label 0 and label 1 to the size of the larger one
 
-    for line in dataset:
-        label = int(line.strip().split(',')[-1])
-        if label not in label_split:
-            label_split[label] = []
-        label_split[label].append(line)
+    :param dataset: List of label file lines, label in the last column
+    :return: Lines of label 0, then lines of label 1, duplicates refer to the same line objects
+    '''
+    labels = np.array([int(line.strip().split(',')[-1]) for line in dataset])
+    index = oversample_index(labels, classes=[0, 1])
 
-    return label_split
+    print np.sum(labels[index] == 0), np.sum(labels[index] == 1)
 
+    return [dataset[i] for i in index]
 
-def balance_dataset_binary(dataset):
-    label_split = split_by_label(dataset)
-    if len(label_split[0]) > len(label_split[1]):
-        label_split[1].extend(np.random.choice(label_split[1], len(label_split[0]) - len(label_split[1])))
-    else:
-        label_split[0].extend(np.random.choice(label_split[0], len(label_split[1]) - len(label_split[0])))
 
-    print len(label_split[0]), len(label_split[1])
+def balance_weights_binary(dataset):
+    '''
+    Class-balanced sample weights of label 0 and label 1, every line is kept once
+
+    :param dataset: List of label file lines, label in the last column
+    :return: Lines of label 0 and 1 in their original order, their sample weights
+    '''
+    labels = np.array([int(line.strip().split(',')[-1]) for line in dataset], dtype=np.int64)
+    rows = np.flatnonzero((labels == 0) | (labels == 1))
 
-    label_split[0].extend(label_split[1])
-    return label_split[0]
+    print np.sum(labels[rows] == 0), np.sum(labels[rows] == 1)
+
+    return [dataset[i] for i in rows], balanced_weights(labels[rows])
+
+
+def load_dates(f_label):
+    '''
+    Load the date column of a label file as day numbers (days since 1970-01-01)
+
+    :param f_label: Path to corpus label file (Company, Date, ...)
+    :return: array of int32 day numbers, one per record (non-header line) of f_label
+    '''
+    with open(f_label, "r") as f:
+        return parse_days([line.split(',')[1] for line in f if not line.startswith('#')])
+
+
+def walk_forward_splits(f_label, train_days, test_days, step_days=None, embargo_days=0, expanding=False,
+                        calendar=None):
+    '''
+    Generate walk-forward (train, test) index pairs over the lines of a label file.
+    Cut dates start train_days after the first date and advance by step_days. For
+    each cut date c, train covers (c - train_days, c] (or everything up to c if
+    expanding), and test covers (c + embargo_days, c + embargo_days + test_days].
+
+    :param f_label: Path to corpus label file, ideally sorted by date
+    :param train_days: Length of the training window in days
+    :param test_days: Length of the test window in days
+    :param step_days: Days between consecutive cut dates, defaults to test_days
+    :param embargo_days: Days left out between the training and the test window
+    :param expanding: Keep all data before the cut date instead of a rolling window
+    :param calendar: TradingCalendar, count all day arguments in trading days instead of calendar days
+    :return: generator of (train, test) index arrays into the records of f_label
+    '''
+    if step_days is None:
+        step_days = test_days
+
+    dates = load_dates(f_label)
+    if calendar is not None:
+        dates = calendar.ordinals(dates, exact=False)
+    order = np.argsort(dates, kind='mergesort')
+    dates = np.asarray(dates)[order]
+
+    cut = dates[0] + train_days
+    while cut + embargo_days < dates[-1]:
+        if expanding:
+            train_start = 0
+        else:
+            train_start = np.searchsorted(dates, cut - train_days, side='right')
+        train_end = np.searchsorted(dates, cut, side='right')
+        test_start = np.searchsorted(dates, cut + embargo_days, side='right')
+        test_end = np.searchsorted(dates, cut + embargo_days + test_days, side='right')
+
+        if train_end > train_start and test_end > test_start:
+            yield order[train_start:train_end], order[test_start:test_end]
+
+        cut += step_days
 
 
 
@@ -95,3 +168,9 @@ if __name__ == '__main__':
     split_date = date(2012, 5, 18)
 
     separate_train_test_validation(split_date, 0.0, f_labels, f_split_out, balance=True)
+
+    ###### Walk-forward backtest, one-year rolling window, monthly cut dates #####
+    '''
+    for train, test in walk_forward_splits(f_labels, train_days=365, test_days=30, embargo_days=1):
+        print len(train), len(test)
+    '''
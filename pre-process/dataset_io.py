@@ -0,0 +1,265 @@
+"""
+bulk reading and writing of feature files
+libsvm lines are formatted in chunks and written with large buffers
+binary datasets are directories of .npy files {data, indices, indptr, shape, labels, index}
+that can be memory mapped, convert them to libsvm text for the external SVM tools:
+both formats are read back as a SparseDataset (csr features, labels, original line index)
+
+    python dataset_io.py dataset.bin dataset.txt
+"""
+
+import os
+import sys
+from itertools import islice
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, issparse
+
+BUFFER_SIZE = 1 << 22  # bytes
+CHUNK_SIZE = 10000  # rows formatted at once
+PARSE_CHUNK_SIZE = 100000  # lines parsed at once
+VALUE_FORMAT = "%.12g"
+BINARY_SUFFIX = ".bin"
+BINARY_FIELDS = ["data", "indices", "indptr", "shape", "labels", "index"]
+WEIGHT_SUFFIX = ".weight"  # per-row sample weights next to a libsvm file, one per line
+
+
+class SparseDataset(object):
+    """
+    features: csr_matrix, column j is libsvm feature j+1
+    labels: one label per row
+    index: line of each row in the original feature file
+    weight: sample weight of each row, None if unweighted
+    """
+    def __init__(self, features, labels, index, weight=None):
+        self.features = features
+        self.labels = labels
+        self.index = index
+        self.weight = weight
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def subset(self, rows):
+        """
+        :param rows: array of row positions
+        :return: SparseDataset of the selected rows, in the given order
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        weight = None if self.weight is None else self.weight[rows]
+        return SparseDataset(self.features[rows], self.labels[rows], self.index[rows], weight)
+
+
+def read_libsvm(path, chunk_size=PARSE_CHUNK_SIZE):
+    """
+    parse a libsvm file straight into csr arrays, chunk_size lines at a time
+    each chunk is parsed by one np.fromstring over the chunk with ':' replaced by ' '
+    :return: SparseDataset, empty lines are skipped but keep their line number in index
+    """
+    labels, indices, data, nnz, index = [], [], [], [], []
+
+    with open(path, "r", BUFFER_SIZE) as f:
+        start = 0
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                break
+            rows = [i for i, line in enumerate(lines) if line.strip()]
+            lines = [lines[i] for i in rows]
+            counts = np.array([line.count(":") for line in lines], dtype=np.int64)
+            values = np.fromstring(" ".join(lines).replace(":", " "), sep=" ")
+
+            lengths = 2 * counts + 1
+            if len(values) != lengths.sum():
+                raise ValueError("malformed libsvm line in {} between lines {} and {}"
+                                 .format(path, start, start + chunk_size))
+            offsets = np.arange(len(values)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+            labels.append(values[offsets == 0])
+            indices.append(values[offsets % 2 == 1].astype(np.int64) - 1)
+            data.append(values[(offsets % 2 == 0) & (offsets > 0)])
+            nnz.append(counts)
+            index.append(np.array(rows, dtype=np.int64) + start)
+            start += chunk_size
+
+    if not labels:
+        return SparseDataset(csr_matrix((0, 0)), np.zeros(0), np.zeros(0, dtype=np.int64))
+
+    indices = np.concatenate(indices)
+    indptr = np.concatenate([[0], np.cumsum(np.concatenate(nnz))])
+    num_features = indices.max() + 1 if len(indices) > 0 else 0
+    features = csr_matrix((np.concatenate(data), indices, indptr), shape=(len(indptr) - 1, num_features))
+    return SparseDataset(features, np.concatenate(labels), np.concatenate(index))
+
+
+def read_sparse_dataset(path, mmap=False):
+    """
+    :param path: libsvm text file or binary dataset directory
+    :param mmap: memory map binary datasets instead of reading them
+    :return: SparseDataset
+    """
+    if is_binary(path):
+        dataset = SparseDataset(*load_binary(path, mmap=mmap))
+    else:
+        dataset = read_libsvm(path)
+    dataset.weight = load_weight(path)
+    return dataset
+
+
+def read_dense(path):
+    """
+    read a whitespace separated matrix, e.g. lda "final.topic"
+    """
+    return pd.read_csv(path, delim_whitespace=True, header=None, dtype=np.float64).values
+
+
+def write_libsvm(file_out, X, labels, chunk_size=CHUNK_SIZE, value_format=VALUE_FORMAT):
+    """
+    write a feature matrix in libsvm format, feature indexes start at 1
+    :param file_out: output file
+    :param X: dense array (every value is written) or sparse matrix (zeros are skipped)
+    :param labels: one label per row of X
+    """
+    labels = np.asarray(labels, dtype=np.float64)
+    if issparse(X):
+        X = _clean_csr(X)
+        format_chunk = _format_sparse
+    else:
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(-1, 1)
+        format_chunk = _format_dense
+
+    with open(file_out, "w", BUFFER_SIZE) as fout:
+        for start in xrange(0, X.shape[0], chunk_size):
+            end = min(start + chunk_size, X.shape[0])
+            fout.write(format_chunk(X[start:end], labels[start:end], value_format))
+
+
+def binary_path(file_out):
+    """
+    x.txt -> x.bin, x.train -> x.train.bin
+    """
+    root, ext = os.path.splitext(file_out)
+    if ext in [".txt", ".csv"]:
+        return root + BINARY_SUFFIX
+    return file_out + BINARY_SUFFIX
+
+
+def is_binary(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "indptr.npy"))
+
+
+def save_binary(path, X, labels, index=None):
+    """
+    save a dataset as a directory of .npy files
+    :param path: output directory, created if missing
+    :param X: dense or sparse feature matrix, column j is libsvm feature j+1
+    :param labels: one label per row
+    :param index: row of each record in the original feature file, defaults to 0..N-1
+    """
+    X = _clean_csr(X)
+    if index is None:
+        index = np.arange(X.shape[0])
+    try:
+        os.stat(path)
+    except:
+        os.mkdir(path)
+    arrays = [X.data, X.indices, X.indptr, np.array(X.shape, dtype=np.int64),
+              np.asarray(labels, dtype=np.float64), np.asarray(index, dtype=np.int64)]
+    for field, array in zip(BINARY_FIELDS, arrays):
+        np.save(os.path.join(path, field + ".npy"), array)
+
+
+def load_binary(path, mmap=True):
+    """
+    :param path: dataset directory written by save_binary
+    :param mmap: memory map the arrays instead of reading them
+    :return: csr_matrix, labels, index
+    """
+    mmap_mode = 'r' if mmap else None
+    data, indices, indptr, shape, labels, index = [np.load(os.path.join(path, field + ".npy"), mmap_mode=mmap_mode)
+                                                   for field in BINARY_FIELDS]
+    X = csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+    return X, labels, index
+
+
+def weight_path(path):
+    """
+    weight.npy inside a binary dataset, x.txt -> x.txt.weight for libsvm text
+    """
+    if is_binary(path):
+        return os.path.join(path, "weight.npy")
+    return path + WEIGHT_SUFFIX
+
+
+def save_weight(path, weight):
+    if is_binary(path):
+        np.save(weight_path(path), np.asarray(weight, dtype=np.float64))
+    else:
+        np.savetxt(weight_path(path), weight, fmt=VALUE_FORMAT)
+
+
+def load_weight(path):
+    """
+    :return: sample weights saved for the dataset at path, None if there are none
+    """
+    f_weight = weight_path(path)
+    if not os.path.exists(f_weight):
+        return None
+    if is_binary(path):
+        return np.load(f_weight)
+    return np.atleast_1d(np.loadtxt(f_weight, dtype=np.float64))
+
+
+def write_dataset(file_out, X, labels, index=None, binary=False, weight=None):
+    """
+    write libsvm text to file_out, or a binary dataset to binary_path(file_out)
+    :param weight: optional sample weight per row, saved next to the dataset (see weight_path),
+                   without weights the weights of an earlier dataset at file_out are removed
+    """
+    if binary:
+        file_out = binary_path(file_out)
+        save_binary(file_out, X, labels, index)
+    else:
+        write_libsvm(file_out, X, labels)
+    if weight is not None:
+        save_weight(file_out, weight)
+    elif os.path.exists(weight_path(file_out)):
+        os.remove(weight_path(file_out))
+
+
+def binary_to_libsvm(path, file_out):
+    X, labels, _ = load_binary(path)
+    write_libsvm(file_out, X, labels)
+
+
+def _clean_csr(X):
+    X = csr_matrix(X)
+    if not X.has_sorted_indices or not np.all(X.data):
+        X = X.copy()
+        X.sum_duplicates()
+        X.eliminate_zeros()
+    return X
+
+
+def _format_dense(chunk, labels, value_format):
+    template = value_format + "".join([" {}:{}".format(i + 1, value_format)
+                                       for i in xrange(chunk.shape[1])]) + "\n"
+    rows = np.column_stack((labels, chunk)).tolist()
+    return "".join([template % tuple(row) for row in rows])
+
+
+def _format_sparse(chunk, labels, value_format):
+    tokens = np.char.add(np.char.mod("%d:", chunk.indices + 1), np.char.mod(value_format, chunk.data)).tolist()
+    labels = np.char.mod(value_format, labels).tolist()
+    indptr = chunk.indptr
+    return "".join([" ".join([labels[i]] + tokens[indptr[i]:indptr[i + 1]]) + "\n"
+                    for i in xrange(chunk.shape[0])])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print "usage: python dataset_io.py $binary_dataset $libsvm_out"
+        exit(1)
+    binary_to_libsvm(sys.argv[1], sys.argv[2])
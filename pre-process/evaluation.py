@@ -1,182 +1,102 @@
-import sys
+import re
 from os import listdir
-from operator import itemgetter
-
-def calculate_metrics(datapoints):
-    '''
-    expects list of tuples as input
-        input datapoints = [(true_label, predicted_label)]
-
-    '''
-
-    cm = generate_confusion_matrix(datapoints=datapoints, show=True)
-
-    p = []
-    r = []
-    f1 = []
-    f05 = []
-    f2 = []
-
-    num_classes = len(cm[0])
-
-    for i in range(num_classes):
-        tp, fn, fp, tn = get_cm_for_class(cm, i)
-
-        precision = 0.0
-        recall = 0.0
-
-        specificity = 0.0
-
-        if tp + fn > 0:
-            recall = max(tp / float(tp + fn), 0)
-
-        if tp + fp > 0:
-            precision = tp / float(tp + fp)
-
-        if fp + tn > 0:
-            specificity = tn / float(fp + tn)
-
-        if precision + recall > 0:
-            F1 = calculate_f_beta(precision, recall, 1)
-            F05 = calculate_f_beta(precision, recall, 0.5)
-            F2 = calculate_f_beta(precision, recall, 2)
-
-        p.append(precision)
-        r.append(recall)
-        f1.append(F1)
-        f05.append(F05)
-        f2.append(F2)
-
-    accuracy = calculate_accuracy(cm)
-
-    return p, r, f1, accuracy
-
-
-def generate_confusion_matrix(datapoints, show=False):
-    '''
-    Generates confusion matrix. Class label -1 is equal to index 0
-    '''
-
-    cm = [[0 for i in range(3)] for j in range(3)]
-
-    for dp in datapoints:
-        true_label = dp[0]
-        pred_label = dp[1]
-
-        cm[true_label + 1][pred_label + 1] += 1
-
-    if show:
-        print '       predicted'
-        print 'true -1 0 1'
-        for i in range(3):
-            print '  ', i-1, cm[i][0], cm[i][1], cm[i][2]
-
-    return cm
-
-
-def get_cm_for_class(cm, class_index):
-    fn = 0
-    fp = 0
-    tn = 0
-
-    tp = cm[class_index][class_index]
-
-    for i in range(len(cm[0])):
-        for j in range(len(cm[i])):
-            if j == class_index:
-                if i != class_index:
-                    fn += cm[i][j]
-
-            if i == class_index:
-                if j != class_index:
-                    fp += cm[i][j]
-
-            if i != class_index and j != class_index:
-                tn += cm[i][j]
-
-    return tp, fn, fp, tn
-
-
-def calculate_accuracy(cm):
-    total = 0
-    tp = 0
-
-    for i in range(len(cm[0])):
-        for j in range(len(cm[i])):
-            total += cm[i][j]
-            if i == j:
-                tp += cm[i][j]
-
-    return tp / float(total)
-
-
-def calculate_f_beta(precision, recall, beta):
-    return float((1 + pow(beta, 2)) * ((precision * recall) / ((pow(beta, 2) * precision) + recall)))
-
-
-def parse_files(file1, file2):
-    true_labels = [int(line.split()[0]) for line in open(file1, 'r').readlines()]
-    pred_labels = [int(line) for line in open(file2, 'r').readlines()]
-
-    datapoints = []
-    for i in range(len(true_labels)):
-        datapoints.append((true_labels[i], pred_labels[i]))
-
-    return datapoints
-
-
-def find_labels_file(path, runid):
-    # print path, run_id
-    for fi in listdir(path):
-        # print path, fi, runid
-        if runid in fi:
-            return "{}/{}".format(path, fi)
-
-def run_evaluation(predictions_root, labels_root):
-    topics = ['t10', 't15', 't20', 't25', 't30', 't35', 't40', 't45', 't50']
-
-
-    for topic in topics:
-        print '---------------------------'
-        num_topic = topic.replace('t', '')
-        lsdirs = sorted(listdir(predictions_root))
-        for folder in lsdirs:
-            if num_topic not in folder:
-                continue
-            features_name = folder.replace("."+topic, "")
-
-
-            for lsdir in listdir(predictions_root + folder):
-                if 'output' in lsdir:
-                    # svm output file
-                    pred_labels_file = "{}{}/{}".format(predictions_root, folder, lsdir)
-                    # test set file
-                    true_labels_file = "{0}{1}/{1}.test".format(labels_root, features_name)
-                    #print "true:", true_labels_file
-                    #print "test:", pred_labels_file
-                    p, r, f, a = calculate_metrics(parse_files(true_labels_file, pred_labels_file))
-
-                    f1_all = (f[0] + f[1] + f[2]) / 3
-                    f1_pos_neg = (f[0] + f[2]) / 2
-
-                    if '_change' in folder:
-                        f1_topic_change.append((f1_all, f1_pos_neg, folder))
-
-                    if '_hist' in folder:
-                        if '_cont' in folder:
-                            f1_topic_hist_cont.append((f1_all, f1_pos_neg, folder))
-                        else:
-                            f1_topic_hist.append((f1_all, f1_pos_neg, folder))
-
-                    accuracy = a * 100
-                    print folder, 'accuracy=', "{0:.2f}".format(accuracy)
-                    for i in range(len(p)):
-                        precision = p[i] * 100
-                        recall = r[i] * 100
-                        f1 = f[i] * 100
-                        print 'class= ', str(i-1), ': precision=', "{0:.2f}".format(precision), 'recall=', "{0:.2f}".format(recall), \
-                          'f1=', "{0:.2f}".format(f1)
-
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from metrics_engine import confusion_matrices, class_metrics, read_predictions, read_true_labels
+
+LABELS = [-1, 0, 1]  # class label -1 is index 0 of the confusion matrices
+FOLDER_TOPIC = re.compile(r'\.t(\d+)$')  # "$features.t$K", number of topics K
+
+def results_catalog(predictions_root, labels_root):
+    """
+    scan a predictions tree once
+    :param predictions_root: folder of "$features.t$K" folders holding svm output files
+    :param labels_root: folder of "$features" folders holding "$features.test"
+    :return: list of (features, K, folder, true labels file, svm output files), ordered by K then folder
+    """
+    catalog = []
+    for folder in sorted(listdir(predictions_root)):
+        match = FOLDER_TOPIC.search(folder)
+        if match is None:
+            continue
+        features_name = folder[:match.start()]
+        outputs = sorted(lsdir for lsdir in listdir(predictions_root + folder) if 'output' in lsdir)
+        if not outputs:
+            continue
+        catalog.append((features_name, int(match.group(1)), folder,
+                        "{0}{1}/{1}.test".format(labels_root, features_name),
+                        ["{}{}/{}".format(predictions_root, folder, lsdir) for lsdir in outputs]))
+
+    catalog.sort(key=lambda entry: entry[1])  # stable, folders stay sorted within a K
+    return catalog
+
+
+def _evaluate_entry(entry):
+    """
+    :return: one results row per svm output file of a catalog entry,
+             the metrics of an unreadable file (wrong length, unknown labels) are nan
+    """
+    features_name, num_topics, folder, true_labels_file, pred_labels_files = entry
+    true_labels = read_true_labels(true_labels_file)
+
+    predictions = []
+    for pred_labels_file in pred_labels_files:
+        try:
+            prediction = read_predictions([pred_labels_file], len(true_labels))[0]
+            if not np.all(np.in1d(prediction, LABELS)):
+                raise ValueError("{} has labels {} outside {}".format(
+                    pred_labels_file, np.setdiff1d(prediction, LABELS), LABELS))
+            predictions.append(prediction)
+        except ValueError as e:
+            print "ERROR: {}, skipped".format(e)
+            predictions.append(None)
+    readable = [k for k, prediction in enumerate(predictions) if prediction is not None]
+
+    # confusion matrices and metrics of all readable output files at once
+    metrics = np.full((len(pred_labels_files), len(results_columns()) - 4), np.nan)
+    if readable:
+        _, cms = confusion_matrices(true_labels, np.vstack([predictions[k] for k in readable]), LABELS)
+        precision, recall, _, (f1,), accuracy = class_metrics(cms)
+        per_class = np.stack([precision, recall, f1], axis=2).reshape(len(readable), -1)
+        metrics[readable] = np.column_stack([accuracy, per_class, f1.mean(axis=1), f1[:, [0, 2]].mean(axis=1)])
+
+    return [[features_name, num_topics, folder, pred_labels_file] + metrics[k].tolist()
+            for k, pred_labels_file in enumerate(pred_labels_files)]
+
+
+def results_columns():
+    columns = ['features', 'K', 'folder', 'output', 'accuracy']
+    for label in LABELS:
+        columns += ['precision_{}'.format(label), 'recall_{}'.format(label), 'f1_{}'.format(label)]
+    return columns + ['f1_all', 'f1_pos_neg']
+
+
+def run_evaluation(predictions_root, labels_root, processes=None):
+    """
+    evaluate every svm output file of a predictions tree
+    :param processes: Number of worker processes, each takes one folder at a time, 1 to run serially
+    :return: DataFrame, one row per svm output file, see results_columns
+    """
+    catalog = results_catalog(predictions_root, labels_root)
+
+    if processes == 1:
+        results = map(_evaluate_entry, catalog)
+    else:
+        pool = Pool(processes)
+        results = pool.map(_evaluate_entry, catalog)
+        pool.close()
+        pool.join()
+
+    return pd.DataFrame([row for rows in results for row in rows], columns=results_columns())
+
+
+def best_model(results, column):
+    """
+    :return: folder and score of the row with the highest score in column
+    """
+    best = results.loc[results[column].idxmax()]
+    return best['folder'], best[column]
 
 
 if __name__ == '__main__':
@@ -186,30 +106,38 @@ if __name__ == '__main__':
     predictions_root = "/Users/ds/git/time-series-predict/results/svm/multi-class/"
     # labels_root = "/home/yiren/Documents/Financial-Topic-Model/data/features/cross_validation/"
     labels_root = "/Users/ds/git/time-series-predict/data/features/time/"
+    results_file = predictions_root + "results.csv"
 
-    # store averages for feature combinations (all, pos_neg, feature_name)
-    f1_topic_change = []
-    f1_topic_hist = []
-    f1_topic_hist_cont = []
-
+    tables = []
     for folder in sorted(listdir(predictions_root)):
         if 'topic_' not in folder:
             continue
 
         st = folder
-        run_evaluation(predictions_root + st + "/",
-                       labels_root + st + "/")
+        tables.append(run_evaluation(predictions_root + st + "/",
+                                     labels_root + st + "/"))
+
+    results = pd.concat(tables, ignore_index=True)
+    results.to_csv(results_file, index=False)
+    print results.to_string(float_format=lambda x: "{0:.4f}".format(x))
+
+    # best models of the feature combinations (all, pos_neg)
+    f1_topic_change = results[results['folder'].str.contains('_change', regex=False)]
+    f1_topic_hist = results[results['folder'].str.contains('_hist', regex=False) &
+                            ~results['folder'].str.contains('_cont', regex=False)]
+    f1_topic_hist_cont = results[results['folder'].str.contains('_hist', regex=False) &
+                                 results['folder'].str.contains('_cont', regex=False)]
 
     print
     print '----SUMMARY----'
     print 'Best model topic change:'
-    print 'All: ', max(f1_topic_change, key=itemgetter(0))[2], ' f1= ', max(f1_topic_change, key=itemgetter(0))[0]
-    print '1,-1:', max(f1_topic_change, key=itemgetter(1))[2], ' f1= ', max(f1_topic_change, key=itemgetter(1))[1]
+    print 'All: ', best_model(f1_topic_change, 'f1_all')[0], ' f1= ', best_model(f1_topic_change, 'f1_all')[1]
+    print '1,-1:', best_model(f1_topic_change, 'f1_pos_neg')[0], ' f1= ', best_model(f1_topic_change, 'f1_pos_neg')[1]
     print
     print 'Best model topic history:'
-    print 'All: ', max(f1_topic_hist, key=itemgetter(0))[2], ' f1= ', max(f1_topic_hist, key=itemgetter(0))[0]
-    print '1,-1:', max(f1_topic_hist, key=itemgetter(1))[2], ' f1= ', max(f1_topic_hist, key=itemgetter(1))[1]
+    print 'All: ', best_model(f1_topic_hist, 'f1_all')[0], ' f1= ', best_model(f1_topic_hist, 'f1_all')[1]
+    print '1,-1:', best_model(f1_topic_hist, 'f1_pos_neg')[0], ' f1= ', best_model(f1_topic_hist, 'f1_pos_neg')[1]
     print
     print 'Best model topic history concatenated:'
-    print 'All: ', max(f1_topic_hist_cont, key=itemgetter(0))[2], ' f1= ', max(f1_topic_hist_cont, key=itemgetter(0))[0]
-    print '1,-1:', max(f1_topic_hist_cont, key=itemgetter(1))[2], ' f1= ', max(f1_topic_hist_cont, key=itemgetter(1))[1]
\ No newline at end of file
+    print 'All: ', best_model(f1_topic_hist_cont, 'f1_all')[0], ' f1= ', best_model(f1_topic_hist_cont, 'f1_all')[1]
+    print '1,-1:', best_model(f1_topic_hist_cont, 'f1_pos_neg')[0], ' f1= ', best_model(f1_topic_hist_cont, 'f1_pos_neg')[1]
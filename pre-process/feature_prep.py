@@ -3,12 +3,15 @@ prepare features for classifier
 """
 
 import os
-import re
-import random
 import numpy as np
+from multiprocessing import Pool
 from parse_stock_files import *
+from price_store import is_store, open_store
+from label_engine import label_matrix, load_stock_changes
+from dataset_io import read_dense, write_dataset, is_binary, load_binary
+from sklearn.datasets import load_svmlight_file
 from datetime import date
-from data_separate import to_date
+from trading_calendar import parse_days, day_number, format_days, INVALID_DAY
 
 
 class FeatureExtractor:
@@ -80,99 +83,79 @@ class FeatureExtractor:
         each line: {company name} {date} {document index} {stock price}
         """
         print "merge stock data with news corpus ...",
-        # load stock price from raw files
+        # load stock price from the price store if it was built (see price_store.py), raw files otherwise
         path_raw = "stocks-raw/"
+        path_store = "stocks-store/"
         cs_dict = company_stock_dictionary(self.path_stocks + "company-stock-mapping.csv")
-        stock_data = dict() # (company, date) -> stock
-
-        def load_stock(file_name):
-            company = re.sub(r'.*_', '', file_name)
-            company = company.replace('.csv', '')
-            company = cs_dict[company]
-            with open(self.path_stocks+path_raw+file_name, "r") as f:
-                lines = f.readlines()
-            for line in lines[1:]:
-                line = line.strip().split(",")
-                date = line[0]
-                Open = line[1]
-                Close = line[4]
-                stock_data[(company, date)] = (Open, Close)
-
-        files_raw = os.listdir(self.path_stocks+path_raw)
-        for file_raw in files_raw:
-            load_stock(file_raw)
+        if is_store(self.path_stocks + path_store):
+            stock_data = open_store(self.path_stocks + path_store, cs_dict)
+        else:
+            stock_data = open_store(self.path_stocks + path_raw, cs_dict)
 
         # merge with news corpus
         with open(self.path_corpus+"corpus_raw.txt", "r") as f:
-            lines = f.readlines()
-
-        fout = open(self.path_corpus+fout_name, "w")
-        cnt = 0
-        for i in xrange(len(lines)):
-            line = lines[i].strip().split("\t")
-            date = re.sub(r'T.*?Z', '', line[1])
-            if (line[0], date) in stock_data:
-                s = line[0] + "," + date + "," + str(i) + "," + ",".join(stock_data[(line[0], date)])
-                print s
-                fout.write(s+"\n")
-                cnt += 1
-        fout.close()
-        print "done!", cnt, "records merged!"
+            records = [line.split("\t", 2)[:2] for line in f]
+        companies = [record[0] for record in records]
+        days = parse_days([record[1] for record in records], errors='coerce')  # time "T..Z" is ignored
+        malformed = days == INVALID_DAY
+
+        matched, Open, Close = stock_data.join(companies, days)
+        matched &= ~malformed
+        rows = np.flatnonzero(matched)
+        dates = format_days(days[rows])
+        lines = ["{},{},{},{!r},{!r}\n".format(companies[i], date, i, Open[i], Close[i])
+                 for i, date in zip(rows, dates)]
+
+        with open(self.path_corpus+fout_name, "w") as fout:
+            fout.writelines(lines)
+        print "done!", len(lines), "records merged!"
+        if np.any(malformed):
+            print "skipped", np.sum(malformed), "records with a malformed date"
 
     def generate_label_multiclass(self, f_stock="corpus_stock.csv", f_label="corpus_label_multiclass.csv"):
         print "generating multi-class labels ...",
 
-        with open(self.path_corpus+f_stock, "r") as f:
-            lines = f.readlines()
-        fout = open(self.path_corpus+f_label, "w")
-        cnt_pos = 0
-        cnt_neg = 0
-        cnt_neu = 0
-
-        for i in xrange(len(lines)-1):
-            line = lines[i].strip().split(",")
-
-            change = float(line[4]) / float(line[3]) - 1.
-            change *= 100.
-
-            if abs(change) < self.significance_buffer_upper and abs(change) > self.significance_buffer_lower:
-                continue
-
-            label = significant_change_multiclass(change)
-
-            if label == 1:
-                cnt_pos += 1
-            if label == -1:
-                cnt_neg += 1
-            else:
-                cnt_neu += 1
-            fout.write(lines[i].strip()+","+str(label)+"\n")
-        fout.write(lines[-1].strip()+",0\n")
-        fout.close()
-        print "done!", cnt_pos, "positives ", cnt_neg, "negatives ", cnt_neu, "neutal"
+        labels, valid = self.label_files([(sig_perc_multic, None,
+                                           self.significance_buffer_upper,
+                                           self.significance_buffer_lower)], f_stock, f_label)
+        labels = labels[:, 0]
+        valid = valid[:, 0]
+        print "done!", np.sum(labels[valid] == 1), "positives ", np.sum(labels[valid] == -1), "negatives ", \
+            np.sum(labels[valid] == 0), "neutal"
 
     def generate_label_regression(self, f_stock="corpus_stock.csv", f_label="corpus_label_regression.csv"):
         print "generating regression labels"
 
-        with open(self.path_corpus+f_stock, "r") as f:
-            lines = f.readlines()
-        fout = open(self.path_corpus+f_label, "w")
-
-        for i in xrange(len(lines)-1):
-            line = lines[i].strip().split(",")
-
-            change = float(line[4]) / float(line[3]) - 1.
-            change *= 100.
-
-            if abs(change) < self.significance_buffer_upper and abs(change) > self.significance_buffer_lower:
-                continue
-
-            fout.write(lines[i].strip()+","+str(change)+"\n")
-        fout.write(lines[-1].strip() + ",0\n")
-        fout.close()
+        lines, change = load_stock_changes(self.path_corpus+f_stock)
+        _, valid = label_matrix(change[:-1], [(np.inf, None,
+                                               self.significance_buffer_upper,
+                                               self.significance_buffer_lower)])
+        write_label_file(self.path_corpus+f_label, lines, change, valid[:, 0])
         print "done!"
 
+    def generate_label_sweep(self, thresholds, f_stock="corpus_stock.csv",
+                             f_label="corpus_label_multiclass_s{0}_i{1}_u{2}_l{3}.csv"):
+        """
+        write multi-class labels for several threshold settings, reading the stock data once
+        the file of a setting is the one generate_label_multiclass writes for it
+        :param thresholds: list of (sig, insig, buffer_upper, buffer_lower), see label_engine.label_matrix
+        :param f_label: output file name, formatted with the threshold setting
+        """
+        print "generating multi-class labels for {} threshold settings ...".format(len(thresholds)),
+        self.label_files(thresholds, f_stock, f_label)
+        print "done!"
 
+    def label_files(self, thresholds, f_stock, f_label):
+        """
+        label the stock changes under every threshold setting and write one label file per setting
+        :param f_label: output file name, formatted with the threshold setting
+        :return: labels, valid of the records but the last, see label_engine.label_matrix
+        """
+        lines, change = load_stock_changes(self.path_corpus+f_stock)
+        labels, valid = label_matrix(change[:-1], thresholds)
+        for t, threshold in enumerate(thresholds):
+            write_label_file(self.path_corpus+f_label.format(*threshold), lines, labels[:, t], valid[:, t])
+        return labels, valid
 
     def separate_train_test_validation(self, split_date, perc_val, f_label="corpus_label_regression.csv", f_split="corpus_split_regression.csv"):
         '''
@@ -192,40 +175,19 @@ class FeatureExtractor:
 
         fout = open(self.path_corpus+f_split, "w")
 
-        train = []
-        test = []
-
-        for line in lines:
-            if to_date(line.split(',')[1]) <= split_date:
-                train.append(line)
-            else:
-                test.append(line)
-
-        validation = []
-
-        random.shuffle(train)
+        # 0 train, 1 test, the last perc_val of the shuffled training lines become validation (2)
+        in_train = parse_days([line.split(',')[1] for line in lines]) <= day_number(split_date)
+        data_set_id = np.where(in_train, 0, 1)
 
-        for i in range(int(len(train) * perc_val)):
-            validation.append(train.pop())
-
-        num_train = 0
-        num_test = 0
-        num_val = 0
-
-        for line in lines:
-            data_set_id = -1
+        train = np.flatnonzero(in_train)
+        np.random.shuffle(train)
+        data_set_id[train[len(train) - int(len(train) * perc_val):]] = 2
 
-            if line in train:
-                data_set_id = 0
-                num_train += 1
-            elif line in test:
-                data_set_id = 1
-                num_test += 1
-            elif line in validation:
-                data_set_id = 2
-                num_val += 1
+        num_train = np.sum(data_set_id == 0)
+        num_test = np.sum(data_set_id == 1)
+        num_val = np.sum(data_set_id == 2)
 
-            fout.write(line.strip() + ",{}\n".format(str(data_set_id)))
+        fout.writelines(["{},{}\n".format(line.strip(), i) for line, i in zip(lines, data_set_id.tolist())])
 
         total = 0.0 + num_val + num_test + num_train
 
@@ -235,22 +197,59 @@ class FeatureExtractor:
     def features_topic_dist(self,
                             f_lda_topic="final.topic",
                             f_corpus="corpus_label.csv",
-                            fileout="topic_dist.csv"):
-        with open(self.path_lda+f_lda_topic, "r") as f:
-            self.topic_distribution = f.readlines()
+                            fileout="topic_dist.csv",
+                            binary=False):
+        self.topic_distribution = read_dense(self.path_lda+f_lda_topic)
         with open(self.path_corpus+f_corpus, "r") as f:
-            lines = f.readlines()
-        fout = open(self.path_features+fileout, "w")
+            lines = [line.strip().split(",") for line in f]
+
+        index = [int(line[2]) for line in lines]
+        labels = [float(line[-1]) for line in lines]
+        write_dataset(self.path_features+fileout, self.topic_distribution[index], labels, binary=binary)
+
+
+def write_label_file(f_label, lines, values, valid):
+    """
+    write "line,value" for the valid records, the last record is always written with value 0
+    :param values, valid: per record, the last record is not looked at
+    """
+    with open(f_label, "w") as fout:
+        fout.writelines(["{},{}\n".format(lines[i], values[i]) for i in np.flatnonzero(valid[:len(lines) - 1])])
+        fout.write(lines[-1] + ",0\n")
+
+
+def topic_history(topic_dist, company_code, decay, window_size):
+    """
+    decayed sum of the previous window_size topic distributions of the same company
+    :param topic_dist: topic distributions (N, K), rows ordered by company and date
+    :param company_code: integer company id per row (N,)
+    :return: topic history (N, K)
+    """
+    topic_hist = np.zeros(topic_dist.shape)
+    for _, topic_hist in topic_history_windows(topic_dist, company_code, decay, window_size):
+        pass
+    return topic_hist
+
+
+def topic_history_windows(topic_dist, company_code, decay, max_window):
+    """
+    topic history for window sizes 1 .. max_window, each window adds one lag to the previous one
+    each lag is one shifted slice of the whole matrix, masked where the company differs
+    :return: generator of (window_size, topic history), the same array is updated in place
+    """
+    topic_hist = np.zeros(topic_dist.shape)
+    for idx_w in xrange(1, max_window + 1):
+        if idx_w < len(topic_dist):
+            same_company = (company_code[idx_w:] == company_code[:-idx_w])[:, None]
+            topic_hist[idx_w:] += topic_dist[:-idx_w] * (decay ** idx_w) * same_company
+        yield idx_w, topic_hist
+
+
+_sweep_generator = None  # FeatureGenerator shared with forked sweep workers
 
-        for line in lines:
-            line = line.strip().split(",")
-            s = line[-1] + " "
-            features = self.topic_distribution[int(line[2])]
-            features = features.strip().split()
-            for i in xrange(len(features)):
-                s += str(i+1) + ":" + str(features[i]) + " "
-            fout.write(s+"\n")
-        fout.close()
+
+def _sweep_folder(args):
+    _sweep_generator.sweep_folder(*args)
 
 
 class FeatureGenerator:
@@ -262,21 +261,24 @@ class FeatureGenerator:
                  path_lda="../results/lda/",
                  f_corpus=None,
                  f_sentiment=None,
-                 decay=0.75, window_size=1):
+                 decay=0.75, window_size=1,
+                 binary=False):
         self.path_features = path_features
         self.path_lda = path_lda
         self.decay = decay
         self.window_size = window_size
+        self.binary = binary  # write binary datasets (dataset_io) instead of libsvm text
 
         self.index = []
         self.company = []
+        self.company_code = []  # integer id per company, compared instead of names
         self.labels = []
         self.topic_dist = []
         self.topic_hist = []
         self.topic_change = []
 
-        self.sentiment = []
-        self.index_sentiment = []
+        self.sentiment = []  # sentiment features, rows sorted by document index
+        self.index_sentiment = []  # sorted document index of each sentiment row
 
         self.load_corpus(f_corpus)
         if f_sentiment:
@@ -296,29 +298,46 @@ class FeatureGenerator:
             self.company.append(record[0])
             self.labels.append(float(record[-1]))
 
-    def load_topic_dist(self, f_lda_topic):
-        self.topic_dist = []
-        with open(f_lda_topic, "r") as f:
-            topic_distributions = f.readlines()
+        self.company_code = np.unique(self.company, return_inverse=True)[1]
 
-        for idx in self.index:
-            topic_dist = topic_distributions[idx].strip().split()
-            topic_dist = np.array([float(td) for td in topic_dist])
-            self.topic_dist.append(topic_dist)
+    def load_topic_dist(self, f_lda_topic):
+        self.topic_dist = read_dense(f_lda_topic)[self.index]
 
     def load_sentiment(self, f_sentiment):
         """
         load sentiment features
         """
         with open(f_sentiment, "r") as f:
-            lines = f.readlines()
-        self.sentiment = []
-        self.index_sentiment = dict()
+            records = [line.strip().split(",") for line in f]
+
+        index = np.array([int(record[2]) for record in records], dtype=np.int64)
+        sentiment = np.array([record[-3:] for record in records], dtype=np.float64).reshape(len(records), -1)
+        order = np.argsort(index, kind='mergesort')
+        self.index_sentiment = index[order]
+        self.sentiment = sentiment[order]
 
-        for idx in range(len(lines)):
-            record = lines[idx].strip().split(",")
-            self.sentiment.append(list(record[-3:]))
-            self.index_sentiment[int(record[2])] = idx
+    def join_sentiment(self):
+        """
+        look up the sentiment of every corpus record by document index
+        :return: rows of the corpus that have sentiment, their sentiment features
+        """
+        index = np.asarray(self.index)
+        if len(self.index_sentiment) == 0:
+            return np.array([], dtype=np.int64), np.zeros((0, 0))
+        # the last record wins for duplicated document indexes
+        pos = np.searchsorted(self.index_sentiment, index, side='right') - 1
+        pos = np.maximum(pos, 0)
+        rows = np.flatnonzero(self.index_sentiment[pos] == index)
+        return rows, self.sentiment[pos[rows]]
+
+    def append_sentiment(self, features):
+        """
+        append sentiment features as a column block
+        :param features: feature matrix, rows aligned with the corpus
+        :return: features of the rows with sentiment, their labels, their rows in the corpus
+        """
+        rows, sentiment = self.join_sentiment()
+        return np.hstack((features[rows], sentiment)), np.asarray(self.labels)[rows], rows
 
     def generate_topic_hist(self):
         for folder in os.listdir(self.path_lda):
@@ -327,31 +346,30 @@ class FeatureGenerator:
             topic_num = folder.split("_")[-1]
             self.load_topic_dist(f_lda_topic=self.path_lda + folder + "/final.topic")
             self.feature_topic_hist()
+            self.output_topic_hist(topic_num)
 
-            # concatenate
-            features = []
-            for idx in range(len(self.topic_hist)):
-                features.append(list(self.topic_dist[idx]) + list(self.topic_hist[idx]))
-            path_out = "{0}topic_hist_d{1}_w{2}_cont/".format(self.path_features, self.decay, self.window_size)
-            try:
-                os.stat(path_out)
-            except:
-                os.mkdir(path_out)
-            file_out = "{0}topic_dist_{2}_hist_d{1}_w{3}_cont.txt".format(path_out, self.decay, topic_num, self.window_size)
-            self.output_features(features=features, labels=self.labels, file_out=file_out)
-
-            # add
-            features = []
-            for idx in range(len(self.topic_hist)):
-                features.append(list(self.topic_dist[idx] + self.topic_hist[idx]))
-            path_out = "{0}topic_hist_d{1}_w{2}/".format(self.path_features, self.decay, self.window_size)
-            try:
-                os.stat(path_out)
-            except:
-                os.mkdir(path_out)
-            file_out = "{0}topic_dist_{2}_hist_d{1}_w{3}.txt".format(path_out, self.decay, topic_num, self.window_size)
-            self.output_features(features=features, labels=self.labels, file_out=file_out)
-
+    def output_topic_hist(self, topic_num):
+        # concatenate
+        features = np.hstack((self.topic_dist, self.topic_hist))
+        path_out = "{0}topic_hist_d{1}_w{2}_cont/".format(self.path_features, self.decay, self.window_size)
+        try:
+            os.stat(path_out)
+        except:
+            os.mkdir(path_out)
+        file_out = "{0}topic_dist_{2}_hist_d{1}_w{3}_cont.txt".format(path_out, self.decay, topic_num, self.window_size)
+        self.output_features(features=features, labels=self.labels, file_out=file_out)
+        self.output_features_sentiment(features=features, file_out=file_out)
+
+        # add
+        features = self.topic_dist + self.topic_hist
+        path_out = "{0}topic_hist_d{1}_w{2}/".format(self.path_features, self.decay, self.window_size)
+        try:
+            os.stat(path_out)
+        except:
+            os.mkdir(path_out)
+        file_out = "{0}topic_dist_{2}_hist_d{1}_w{3}.txt".format(path_out, self.decay, topic_num, self.window_size)
+        self.output_features(features=features, labels=self.labels, file_out=file_out)
+        self.output_features_sentiment(features=features, file_out=file_out)
 
     def generate_topic_change(self):
         for folder in os.listdir(self.path_lda):
@@ -360,48 +378,83 @@ class FeatureGenerator:
             topic_num = folder.split("_")[-1]
             self.load_topic_dist(f_lda_topic=self.path_lda + folder + "/final.topic")
             self.feature_topic_change()
+            self.output_topic_change(topic_num)
+
+    def output_topic_change(self, topic_num):
+        features = []
+        for idx in range(len(self.topic_change)):
+            features.append(list(self.topic_dist[idx]) + list(self.topic_change[idx]))
+        path_out = "{0}topic_change/".format(self.path_features)
+        try:
+            os.stat(path_out)
+        except:
+            os.mkdir(path_out)
+        file_out = "{0}topic_change_{1}.txt".format(path_out, topic_num)
+        self.output_features(features=features, labels=self.labels, file_out=file_out)
 
-            features = []
-            for idx in range(len(self.topic_change)):
-                features.append(list(self.topic_dist[idx]) + list(self.topic_change[idx]))
-            path_out = "{0}topic_change/".format(self.path_features)
+    def generate_sweep(self, params_decay, params_window_size, processes=None):
+        """
+        generate topic_hist for every (decay, window_size) and topic_change
+        the corpus is loaded once, each topic file once per lda folder
+        :param processes: number of worker processes, each takes one lda folder (K) at a time
+        """
+        folders = [folder for folder in sorted(os.listdir(self.path_lda)) if "lda_result" in folder]
+
+        # create output folders up front so that workers only write files
+        paths_out = ["{0}topic_change/".format(self.path_features)]
+        for decay in params_decay:
+            for window_size in params_window_size:
+                paths_out.append("{0}topic_hist_d{1}_w{2}_cont/".format(self.path_features, decay, window_size))
+                paths_out.append("{0}topic_hist_d{1}_w{2}/".format(self.path_features, decay, window_size))
+        if len(self.sentiment) > 0:
+            paths_out += [path_out[:-1] + "_sentiment/" for path_out in paths_out[1:]]
+        for path_out in paths_out:
             try:
                 os.stat(path_out)
             except:
                 os.mkdir(path_out)
-            file_out = "{0}topic_change_{1}.txt".format(path_out, topic_num)
-            self.output_features(features=features, labels=self.labels, file_out=file_out)
 
+        global _sweep_generator
+        _sweep_generator = self
+        tasks = [(folder, params_decay, params_window_size) for folder in folders]
+        if processes == 1:
+            map(_sweep_folder, tasks)
+        else:
+            pool = Pool(processes)
+            pool.map(_sweep_folder, tasks)
+            pool.close()
+            pool.join()
+
+    def sweep_folder(self, folder, params_decay, params_window_size):
+        topic_num = folder.split("_")[-1]
+        print "sweeping", folder, "..."
+        self.load_topic_dist(f_lda_topic=self.path_lda + folder + "/final.topic")
+
+        for decay in params_decay:
+            self.decay = decay
+            windows = topic_history_windows(self.topic_dist, self.company_code, decay, max(params_window_size))
+            for window_size, topic_hist in windows:
+                if window_size not in params_window_size:
+                    continue
+                self.window_size = window_size
+                self.topic_hist = topic_hist
+                self.output_topic_hist(topic_num)
 
+        # topic change alters topic_dist in place, so it goes last
+        self.feature_topic_change()
+        self.output_topic_change(topic_num)
 
     def add_sentiment(self, f_feature, file_out):
-        # load features from exsiting file
-        with open(self.path_features+f_feature, "r") as f:
-            lines = f.readlines()
-        fout = open(self.path_features+file_out, "w")
-
-        for lidx in range(len(lines)):
-            if self.index[lidx] not in self.index_sentiment:
-                continue
-            sentiment_idx = self.index_sentiment[self.index[lidx]]
-            feature_num = len(lines[lidx].strip().split())
-            s = lines[lidx].strip() + " "
-            for i in range(3):
-                s += str(i+feature_num) + ":" + self.sentiment[sentiment_idx][i] + " "
-            fout.write(s + "\n")
-        fout.close()
+        # load features from exsiting file, prefer append_sentiment on features still in memory
+        if is_binary(self.path_features+f_feature):
+            features = load_binary(self.path_features+f_feature)[0]
+        else:
+            features = load_svmlight_file(self.path_features+f_feature, zero_based=False)[0]
+        features, labels, rows = self.append_sentiment(features.toarray())
+        self.output_features(features=features, labels=labels, index=rows, file_out=self.path_features+file_out)
 
     def feature_topic_hist(self):
-        self.topic_hist = []
-        for idx in range(len(self.topic_dist)):
-            topic_hist = np.zeros(self.topic_dist[idx].shape)
-            for idx_w in range(1, self.window_size+1):
-                if idx-idx_w < 0:
-                    continue
-                if self.company[idx-idx_w] != self.company[idx]: # out of boundry
-                    continue
-                topic_hist += self.topic_dist[idx-idx_w] * (self.decay ** idx_w)
-            self.topic_hist.append(topic_hist)
+        self.topic_hist = topic_history(self.topic_dist, self.company_code, self.decay, self.window_size)
 
     def feature_topic_change(self):
         self.topic_change = []
@@ -414,16 +467,25 @@ class FeatureGenerator:
             topic_change -= self.topic_dist[idx-1]
             self.topic_change.append(topic_change)
 
-    def output_features(self, features, labels, file_out):
-        fout = open(file_out, "w")
-        for i in range(len(features)):
-            s = str(labels[i]) + " "
-            feature = features[i]
-            for idx in range(len(feature)):
-                s += str(idx+1) + ":" + str(feature[idx]) + " "
-            #print s
-            fout.write(s + "\n")
-        fout.close()
+    def output_features(self, features, labels, file_out, index=None):
+        write_dataset(file_out, features, labels, index=index, binary=self.binary)
+
+    def output_features_sentiment(self, features, file_out):
+        """
+        write features + sentiment next to file_out, e.g. topic_hist_d1_w1/x.txt -> topic_hist_d1_w1_sentiment/x_sentiment.txt
+        nothing is written if no sentiment is loaded
+        """
+        if len(self.sentiment) == 0:
+            return
+        folder, file_name = os.path.split(file_out)
+        path_out = folder + "_sentiment/"
+        try:
+            os.stat(path_out)
+        except:
+            os.mkdir(path_out)
+        features, labels, rows = self.append_sentiment(features)
+        self.output_features(features=features, labels=labels, index=rows,
+                             file_out=path_out + file_name.replace(".txt", "_sentiment.txt"))
 
 
 if __name__ == "__main__":
@@ -474,33 +536,19 @@ if __name__ == "__main__":
     params_decay = [1, 0.9, 0.8, 0.7]
     params_window_size = [1, 2, 3, 4, 5, 6]
 
-    for decay in params_decay:
-        for window_size in params_window_size:
-            FG = FeatureGenerator(path_features=path_features, path_lda=path_lda, f_corpus=f_corpus,
-                                  decay=decay, window_size=window_size)
-            FG.generate_topic_hist()
-            FG.generate_topic_change()
+    FG = FeatureGenerator(path_features=path_features, path_lda=path_lda, f_corpus=f_corpus)
+    FG.generate_sweep(params_decay=params_decay, params_window_size=params_window_size)
 
 
     # ===========================================
     # add sentiment features
+    # topic_hist_*_sentiment folders are written from the in-memory features
     # ===========================================
     '''
     path_features = "../data/features/"
     f_corpus = "../data/lda/corpus_label.csv"
     f_sentiment = "../data/sentiment.txt"
 
-    FG = FeatureGenerator(path_features=path_features, f_corpus=f_corpus, f_sentiment=f_sentiment)
-    folders = os.listdir(path_features)
-    for folder in folders:
-        if "hist" not in folder:
-            continue
-        new_folder = folder + "_sentiment"
-        try:
-            os.stat(path_features + new_folder)
-        except:
-            os.mkdir(path_features + new_folder)
-        for feature_file in os.listdir(path_features+folder+"/"):
-            FG.add_sentiment(f_feature=folder+"/"+feature_file,
-                             file_out=new_folder+"/"+feature_file.replace(".txt", "_sentiment.txt"))
+    FG = FeatureGenerator(path_features=path_features, path_lda=path_lda, f_corpus=f_corpus, f_sentiment=f_sentiment)
+    FG.generate_sweep(params_decay=params_decay, params_window_size=params_window_size)
     '''
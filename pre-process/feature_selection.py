@@ -1,7 +1,8 @@
 import cPickle as pkl
 import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.special import chdtrc, erfc
 from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.feature_selection import  SelectKBest, chi2, mutual_info_classif
 
 class DataPoints:
     def __init__(self):
@@ -57,30 +58,132 @@ class DataReader:
               "valid:", len(self.valid.y), "test:", len(self.test.y)
 
 
-def get_ngram_scores(data_reader, scores_out, max_order, feature_selection_method, topK="all"):
-    print "calculating {} scores for {}-grams...".format(feature_selection_method.func_name, max_order)
+class ClassCounts:
+    """
+    class-conditional counts of a sparse count matrix, gathered in one pass over its nonzeros
+    zero entries are never visited, the zero count of a column is its class total minus its nonzeros
+    """
+    def __init__(self, X, y):
+        X = csr_matrix(X)
+        self.classes, labels = np.unique(y, return_inverse=True)
+        self.num_samples, self.num_features = X.shape
+        self.class_total = np.bincount(labels, minlength=len(self.classes))
+        num_classes = len(self.classes)
+
+        rows = np.repeat(np.arange(self.num_samples), np.diff(X.indptr))
+        nonzero = X.data != 0
+        cols = X.indices[nonzero].astype(np.int64)
+        values = X.data[nonzero]
+        cls = labels[rows[nonzero]]
+
+        # per (column, class): sum of the values (chi2) and number of nonzeros (zero category of mi)
+        cells = cols * num_classes + cls
+        shape = (self.num_features, num_classes)
+        self.sums = np.bincount(cells, weights=values, minlength=shape[0] * shape[1]).reshape(shape)
+        self.nonzeros = np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape)
+
+        # per distinct (column, value, class): number of rows, mi treats every count value as a category
+        order = np.lexsort((cls, values, cols))
+        cols, values, cls = cols[order], values[order], cls[order]
+        new_value = np.ones(len(cols), dtype=bool)
+        new_value[1:] = (cols[1:] != cols[:-1]) | (values[1:] != values[:-1])
+        new_cell = new_value.copy()
+        new_cell[1:] |= cls[1:] != cls[:-1]
+        starts = np.flatnonzero(new_cell)
+        self.cell_count = np.diff(np.append(starts, len(cols)))
+        self.cell_column = cols[starts]
+        self.cell_class = cls[starts]
+        self.cell_value = (np.cumsum(new_value) - 1)[starts]  # id of the (column, value) category
+
+    def chi2(self):
+        """
+        same statistic as sklearn.feature_selection.chi2
+        :return: chi2 scores, p-values
+        """
+        expected = self.sums.sum(axis=1)[:, None] * (self.class_total / float(self.num_samples))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores = ((self.sums - expected) ** 2 / expected).sum(axis=1)
+        # columns without counts score nan, chdtrc is very slow on nan so only finite scores are passed
+        pvalues = np.full(len(scores), np.nan)
+        finite = np.isfinite(scores)
+        if len(self.classes) == 2:
+            pvalues[finite] = erfc(np.sqrt(scores[finite] / 2.))  # chi2 survival function with one degree of freedom
+        else:
+            pvalues[finite] = chdtrc(len(self.classes) - 1, scores[finite])
+        return scores, pvalues
+
+    def mutual_info(self):
+        """
+        exact discrete mutual information (in nats) of each column and the labels,
+        same as sklearn.feature_selection.mutual_info_classif on a sparse count matrix
+        """
+        n = float(self.num_samples)
+        count = self.cell_count.astype(np.float64)
+        value_total = np.bincount(self.cell_value, weights=count)[self.cell_value]
+        terms = count / n * np.log(n * count / (value_total * self.class_total[self.cell_class]))
+        mi = np.bincount(self.cell_column, weights=terms, minlength=self.num_features).astype(np.float64)
+
+        # the zero category of every column
+        zeros = (self.class_total - self.nonzeros).astype(np.float64)
+        zero_total = zeros.sum(axis=1)[:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            terms = zeros / n * np.log(n * zeros / (zero_total * self.class_total))
+        mi += np.where(zeros > 0, terms, 0.).sum(axis=1)
+        return mi
+
+
+def sparse_chi2(X, y):
+    """
+    chi2 scores from one sparse pass, see ClassCounts
+    """
+    return ClassCounts(X, y).chi2()
 
-    vocab = None
-    vocab_size = None
-    scores = []
 
-    count_vectorizer= CountVectorizer(vocabulary=vocab,
-                                      max_features=vocab_size,
-                                      ngram_range=(1, max_order))
-    x_train = count_vectorizer.fit_transform(data_reader.train.x_doc)
-    vocab = count_vectorizer.vocabulary_
-    fs = SelectKBest(feature_selection_method, topK)
-    fs_train = fs.fit_transform(x_train, data_reader.train.y)
-    feature_names = count_vectorizer.get_feature_names()
-    for i, score in enumerate(fs.scores_):
-        scores.append((score, feature_names[i]))
+def sparse_mutual_info(X, y):
+    """
+    discrete mutual information from one sparse pass, see ClassCounts
+    """
+    return ClassCounts(X, y).mutual_info()
+
 
+def write_scores(scores_out, feature_scores, feature_names):
+    """
+    write "ngram,score" lines, highest score first
+    """
+    scores = zip(feature_scores, feature_names)
     scores.sort(reverse=True)
 
     with open(scores_out, 'w') as out:
         [out.write('{},{}\n'.format(score[1], score[0])) for score in scores]
 
 
+def get_ngram_score_tables(data_reader, tables):
+    """
+    vectorize the training documents once at the largest order of the tables,
+    the columns of lower orders are selected by mask instead of refitting the vectorizer
+    :param tables: list of (scores_out, max_order, feature_selection_method)
+    """
+    max_order = max(table[1] for table in tables)
+    print "vectorizing {}-grams...".format(max_order)
+    count_vectorizer = CountVectorizer(ngram_range=(1, max_order))
+    x_train = count_vectorizer.fit_transform(data_reader.train.x_doc).tocsc()
+    feature_names = np.array(count_vectorizer.get_feature_names(), dtype=object)
+    feature_order = np.array([name.count(' ') + 1 for name in feature_names])
+
+    columns = dict()  # order -> (features, names) of all n-grams up to order
+    for scores_out, order, feature_selection_method in tables:
+        print "calculating {} scores for {}-grams...".format(feature_selection_method.func_name, order)
+        if order not in columns:
+            mask = feature_order <= order
+            columns[order] = x_train[:, mask].tocsr(), feature_names[mask].tolist()
+        x_order, names = columns[order]
+
+        feature_scores = feature_selection_method(x_order, data_reader.train.y)
+        if isinstance(feature_scores, tuple):
+            feature_scores = feature_scores[0]  # scores, p-values
+        write_scores(scores_out, feature_scores, names)
+
+
 if __name__ == '__main__':
     dir_data = "/Users/ds/git/financial-topic-modeling/data/bpcorpus/"
     f_dataset_docs = dir_data + "lda_features_201705/corpus_bp_stock_cls.npz"
@@ -91,7 +194,7 @@ if __name__ == '__main__':
 
 
     data_reader = DataReader(dataset=f_dataset_docs)
-    get_ngram_scores(data_reader, unigram_chi_scores_out, 1, feature_selection_method=chi2)
-    get_ngram_scores(data_reader, unigram_mi_scores_out, 1, feature_selection_method=mutual_info_classif)
-    get_ngram_scores(data_reader, bigram_chi_scores_out, 2, feature_selection_method=chi2, topK=57216)
-    get_ngram_scores(data_reader, bigram_mi_scores_out, 2, feature_selection_method=mutual_info_classif, topK=57216)
+    get_ngram_score_tables(data_reader, [(unigram_chi_scores_out, 1, sparse_chi2),
+                                         (unigram_mi_scores_out, 1, sparse_mutual_info),
+                                         (bigram_chi_scores_out, 2, sparse_chi2),
+                                         (bigram_mi_scores_out, 2, sparse_mutual_info)])
@@ -0,0 +1,55 @@
+"""
+vectorized label generation
+percentage changes are computed once, labels for many threshold settings in one pass
+"""
+
+import numpy as np
+
+
+def percentage_change(Open, Close):
+    """
+    :param Open: opening prices
+    :param Close: closing prices
+    :return: percentage change from Open to Close
+    """
+    return (np.asarray(Close, dtype=np.float64) / np.asarray(Open, dtype=np.float64) - 1.) * 100.
+
+
+def label_matrix(change, thresholds):
+    """
+    label percentage changes for a list of threshold settings
+    :param change: percentage changes, shape (N,)
+    :param thresholds: list of (sig, insig, buffer_upper, buffer_lower)
+                       sig: |change| >= sig is significant, labelled 1 (up) or -1 (down), otherwise 0
+                       insig: keep non-significant records only if |change| <= insig, None keeps all
+                       buffer_upper/buffer_lower: drop records with buffer_lower < |change| < buffer_upper,
+                       None disables the buffer
+    :return: labels: int8 array (N, T)
+             valid: bool array (N, T), False for records dropped under a setting
+    """
+    change = np.asarray(change, dtype=np.float64)
+    inf = np.inf
+    sig = np.array([t[0] for t in thresholds], dtype=np.float64)
+    insig = np.array([inf if t[1] is None else t[1] for t in thresholds], dtype=np.float64)
+    upper = np.array([0. if t[2] is None else t[2] for t in thresholds], dtype=np.float64)
+    lower = np.array([0. if t[3] is None else t[3] for t in thresholds], dtype=np.float64)
+
+    abs_change = np.abs(change)[:, None]
+    with np.errstate(invalid='ignore'):
+        significant = abs_change >= sig
+        labels = np.where(significant, np.where(change[:, None] > 0, 1, -1), 0).astype(np.int8)
+        valid = significant | (abs_change <= insig) | np.isposinf(insig)
+        valid &= ~((abs_change < upper) & (abs_change > lower))
+
+    return labels, valid
+
+
+def load_stock_changes(f_stock):
+    """
+    :param f_stock: corpus stock file, each line: {company, date, doc_idx, Open, Close}
+    :return: lines (stripped), percentage change per line
+    """
+    with open(f_stock, "r") as f:
+        lines = [line.strip() for line in f]
+    prices = np.array([line.rsplit(",", 2)[1:] for line in lines], dtype=np.float64).reshape(-1, 2)
+    return lines, percentage_change(prices[:, 0], prices[:, 1])
@@ -0,0 +1,114 @@
+"""
+vectorized classification metrics
+confusion matrices of many prediction vectors are counted by one bincount over encoded label pairs,
+per class metrics are computed for all matrices and classes at once
+"""
+
+import numpy as np
+
+
+def encode_labels(values, labels):
+    """
+    :param values: label array of any shape
+    :param labels: sorted label set
+    :return: index of each value in labels
+    """
+    values = np.asarray(values)
+    codes = np.minimum(np.searchsorted(labels, values), len(labels) - 1)
+    if not np.all(labels[codes] == values):
+        raise ValueError("labels {} not in label set {}".format(np.setdiff1d(values, labels), labels))
+    return codes
+
+
+def confusion_matrices(true_labels, predictions, labels=None):
+    """
+    :param true_labels: true label of each record, shape (N,)
+    :param predictions: predicted labels, shape (N,) or (M, N) for M prediction vectors
+    :param labels: label set, defaults to all labels seen
+    :return: labels (sorted), confusion matrices (M, L, L) or (L, L), rows true, columns predicted
+    """
+    true_labels = np.asarray(true_labels)
+    predictions = np.asarray(predictions)
+    single = predictions.ndim == 1
+    predictions = np.atleast_2d(predictions)
+    if predictions.shape[1] != len(true_labels):
+        raise ValueError("{} predictions for {} records".format(predictions.shape[1], len(true_labels)))
+
+    if labels is None:
+        labels = np.union1d(np.unique(true_labels), np.unique(predictions))
+    labels = np.sort(np.asarray(labels))
+    num_labels = len(labels)
+    num_vectors = predictions.shape[0]
+
+    pairs = encode_labels(true_labels, labels) * num_labels + encode_labels(predictions, labels)
+    pairs += np.arange(num_vectors)[:, None] * num_labels * num_labels
+    cm = np.bincount(pairs.ravel(), minlength=num_vectors * num_labels * num_labels)
+    cm = cm.reshape(num_vectors, num_labels, num_labels)
+    return labels, cm[0] if single else cm
+
+
+def class_counts(cm):
+    """
+    :param cm: confusion matrices (..., L, L), rows true, columns predicted
+    :return: tp, fn, fp, tn of every class, each (..., L)
+    """
+    cm = np.asarray(cm)
+    tp = np.diagonal(cm, axis1=-2, axis2=-1)
+    fn = cm.sum(axis=-1) - tp
+    fp = cm.sum(axis=-2) - tp
+    tn = cm.sum(axis=(-2, -1))[..., None] - tp - fn - fp
+    return tp, fn, fp, tn
+
+
+def _ratio(numerator, denominator):
+    """
+    numerator / denominator, 0 where denominator is 0
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), 0.)
+
+
+def f_beta(precision, recall, beta):
+    beta2 = beta * beta
+    return _ratio((1 + beta2) * precision * recall, beta2 * precision + recall)
+
+
+def class_metrics(cm, betas=(1,)):
+    """
+    :param cm: confusion matrices (..., L, L), rows true, columns predicted
+    :param betas: F-beta scores to compute
+    :return: precision, recall, specificity (..., L), list of F-beta (..., L) in the order of betas,
+             accuracy (...), metrics of a class without records are 0
+    """
+    tp, fn, fp, tn = class_counts(cm)
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    specificity = _ratio(tn, tn + fp)
+    f = [f_beta(precision, recall, beta) for beta in betas]
+    accuracy = _ratio(tp.sum(axis=-1), np.asarray(cm).sum(axis=(-2, -1)))
+    return precision, recall, specificity, f, accuracy
+
+
+def read_predictions(files, num_records=None):
+    """
+    :param files: svm output files of the same test set, one integer label per line
+    :param num_records: number of records of the test set, defaults to the length of the first file
+    :return: predictions (M, N)
+    """
+    predictions = []
+    for f in files:
+        predictions.append(np.fromstring(open(f, 'r').read(), dtype=np.int64, sep=' '))
+        if num_records is None:
+            num_records = len(predictions[0])
+        if len(predictions[-1]) != num_records:
+            raise ValueError("{} has {} predictions for {} records".format(f, len(predictions[-1]), num_records))
+    return np.vstack(predictions)
+
+
+def read_true_labels(f_labels):
+    """
+    :param f_labels: libsvm file, the label is the first token of each line
+    """
+    with open(f_labels, 'r') as f:
+        return np.array([int(line.split()[0]) for line in f], dtype=np.int64)
@@ -1,13 +1,18 @@
 import pandas as pd
+import numpy as np
 import csv
-import re
-from os import listdir
+from itertools import imap
+from multiprocessing import Pool
+from price_store import open_store
 
-stock_folder = 'data/stock-prices/'
+stock_folder = 'data/stock-prices/'  # raw csv files, or a store built by price_store.py
 company_stock_file = 'data/company-stock-mapping.csv'
 output_file = 'data/stock-data.csv'
 sig_perc = 2
 sig_perc_multic = 1
+processes = None  # worker processes, each takes one stock at a time, 1 to run serially
+
+OUTPUT_COLUMNS = ['Change_per_1', 'Close_1', 'Company', 'Date', 'sig?', 'sig_mc?']
 
 
 def significant_change(x, sig_perc=2):
@@ -35,37 +40,72 @@ def company_stock_dictionary(path):
     return dictionary
 
 
-if __name__ == '__main__':
+def stock_changes(df, company):
+    """
+    vectorized significant_change / significant_change_multiclass over one stock file
+    :param df: DataFrame {Date, Close, ...} in raw file order
+    :param company: company name of the stock
+    :return: DataFrame with OUTPUT_COLUMNS
+    """
+    close_1 = df['Close'].shift(+1)
+    change = (1 - close_1 / close_1.shift(-1)) * -100
 
-    cs_dict = company_stock_dictionary(company_stock_file)
+    abs_change = np.abs(change.values)
+    with np.errstate(invalid='ignore'):
+        sig = (abs_change >= sig_perc).astype(np.int64)
+        sig_mc = np.where(abs_change >= sig_perc_multic, np.where(change.values > 0, 1, -1), 0)
+
+    return pd.DataFrame({'Change_per_1': change.values, 'Close_1': close_1.values, 'Company': company,
+                         'Date': df['Date'].values, 'sig?': sig, 'sig_mc?': sig_mc}, columns=OUTPUT_COLUMNS)
 
-    stock_data = pd.DataFrame(columns=['Date', 'Company', 'Change_per_1', 'sig?'])
 
-    # print stock_data
+_stock_prices = None  # PriceStore shared with forked workers
+_cs_dict = None
 
-    for stock_file in listdir(stock_folder):
-        company = re.sub(r'.*_', '', stock_file)
-        company = company.replace('.csv', '')
 
-        stock_file = stock_folder + stock_file
-        f = open(stock_file, 'r')
-        df = pd.DataFrame.from_csv(f, index_col=False)
+def _stock_changes(symbol):
+    """
+    :return: first rows of the changes, all changes formatted as csv lines
+    """
+    df = stock_changes(_stock_prices.frame(symbol), _cs_dict[symbol])
+    return df[:10], df.to_csv(None, header=False, index=False)
 
-        df['Close_1'] = df['Close'].shift(+1)
 
-        df['Change_per_1'] = df['Close_1'] / df['Close_1'].shift(-1)
-        df['Change_per_1'] = df.apply(lambda row: (1 - row['Change_per_1']) * -100, axis=1)
+def parse_stock_files(stock_folder, cs_dict, output_file, processes=None):
+    """
+    stream the changes of every stock to output_file, one stock at a time
+    :param stock_folder: folder of raw csv files, or a store built by price_store.py
+    :param cs_dict: mapping of stock symbols to company names
+    :param processes: Number of worker processes, 1 to run serially
+    """
+    global _stock_prices, _cs_dict
+    _stock_prices = open_store(stock_folder)
+    _cs_dict = cs_dict
 
-        df['sig?'] = df.apply(lambda row: significant_change(row['Change_per_1']), axis=1)
+    if processes == 1:
+        pool = None
+        results = imap(_stock_changes, _stock_prices.symbols)
+    else:
+        pool = Pool(processes)
+        results = pool.imap(_stock_changes, _stock_prices.symbols)
+
+    head = None
+    with open(output_file, 'w') as fout:
+        fout.write(','.join(OUTPUT_COLUMNS) + '\n')
+        for first_rows, lines in results:
+            fout.write(lines)
+            if head is None or len(head) < 10:
+                head = first_rows if head is None else pd.concat([head, first_rows], ignore_index=True)
 
-        df['sig_mc?'] = df.apply(lambda row: significant_change_multiclass(row['Change_per_1']), axis=1)
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-        df['Company'] = df.apply(lambda row: cs_dict[company], axis=1)
+    return head[:10] if head is not None else None
 
-        # print df[:10]
 
-        stock_data = stock_data.append(df[['Date', 'Company', 'Close_1', 'Change_per_1', 'sig?', 'sig_mc?']], ignore_index=True)
+if __name__ == '__main__':
 
-    print stock_data[:10]
+    cs_dict = company_stock_dictionary(company_stock_file)
 
-    stock_data.to_csv(output_file, index_label=False, index=False)
\ No newline at end of file
+    print parse_stock_files(stock_folder, cs_dict, output_file, processes)
@@ -0,0 +1,220 @@
+"""
+columnar store of raw stock prices
+one sorted date array and float price columns per symbol
+
+the raw per-symbol csv files are ingested once into a store directory of memory-mappable .npy files,
+every column concatenated over all symbols, with symbols.tsv mapping symbols to companies:
+
+    python price_store.py stocks-raw/ stocks-store/ [company-stock-mapping.csv]
+"""
+
+import os
+import re
+import sys
+import csv
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ["open", "high", "low", "close", "volume"]
+RAW_COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume"]
+STORE_COLUMNS = ["date", "row"] + PRICE_COLUMNS  # date: day numbers, row: line of the record in the raw file
+STORE_INDEX = "symbols.tsv"  # symbol \t company, in ingestion order
+
+
+def symbol_of(file_name):
+    """
+    table_aapl.csv -> aapl
+    """
+    symbol = re.sub(r'.*_', '', file_name)
+    return symbol.replace('.csv', '')
+
+
+def read_stock_file(path):
+    """
+    :return: DataFrame {Date, Open, High, Low, Close, Volume} in file order
+    """
+    return pd.read_csv(path, usecols=lambda column: column in RAW_COLUMNS)
+
+
+def is_store(path):
+    return os.path.exists(os.path.join(path, STORE_INDEX))
+
+
+def open_store(path, cs_dict=None, mmap=True):
+    """
+    :param path: store directory, or folder of raw csv files (parsed on the fly)
+    :param cs_dict: mapping of stock symbols to company names, defaults to the mapping of the store
+    """
+    if is_store(path):
+        return PriceStore().load(path, cs_dict, mmap)
+    return PriceStore().load_raw(path, cs_dict)
+
+
+class PriceStore:
+    """
+    stock prices indexed by symbol and by company
+    dates are datetime64[D], sorted ascending
+    """
+    def __init__(self):
+        self.symbols = []  # symbols in ingestion order
+        self.company = dict()  # symbol -> company name, None if unmapped
+        self.company_symbol = dict()  # company name -> symbol, the symbol set last wins
+        self.columns = dict()  # symbol -> {column -> array aligned with sorted dates}, see STORE_COLUMNS
+
+    def load_raw(self, path_raw, cs_dict=None):
+        """
+        load all raw stock files in a folder
+        :param path_raw: folder with one csv per stock {Date, Open, High, Low, Close, Volume, ...}
+        :param cs_dict: mapping of stock symbols to company names
+        """
+        for file_name in os.listdir(path_raw):
+            symbol = symbol_of(file_name)
+            df = read_stock_file(os.path.join(path_raw, file_name))
+            self.add_symbol(symbol, None if cs_dict is None else cs_dict.get(symbol), df["Date"].values,
+                            *[df[column].values if column in df else np.full(len(df), np.nan)
+                              for column in RAW_COLUMNS[1:]])
+        return self
+
+    def add_symbol(self, symbol, company, dates, Open, High, Low, Close, Volume):
+        """
+        add the records of one raw file, in file order
+        """
+        dates = np.array(dates, dtype='datetime64[D]').astype(np.int64)
+        order = np.argsort(dates, kind='mergesort')
+        values = [dates, np.arange(len(dates))] + [np.asarray(v, dtype=np.float64) for v in
+                                                   [Open, High, Low, Close, Volume]]
+        self.set_symbol(symbol, company, dict((column, value[order]) for column, value in zip(STORE_COLUMNS, values)))
+
+    def set_symbol(self, symbol, company, columns):
+        if symbol not in self.columns:
+            self.symbols.append(symbol)
+        elif self.company_symbol.get(self.company[symbol]) == symbol:
+            del self.company_symbol[self.company[symbol]]
+        self.company[symbol] = company
+        self.columns[symbol] = columns
+        if company is not None:
+            self.company_symbol[company] = symbol
+
+    def company_columns(self, company):
+        """
+        :return: columns of the symbol of a company (see STORE_COLUMNS), None if the company has no stock
+        """
+        symbol = self.company_symbol.get(company)
+        return None if symbol is None else self.columns[symbol]
+
+    def save(self, store_dir):
+        """
+        write the store as one .npy per column plus offsets.npy and STORE_INDEX
+        """
+        try:
+            os.stat(store_dir)
+        except:
+            os.mkdir(store_dir)
+        lengths = [len(self.columns[symbol]["date"]) for symbol in self.symbols]
+        np.save(os.path.join(store_dir, "offsets.npy"), np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+        for column in STORE_COLUMNS:
+            values = [self.columns[symbol][column] for symbol in self.symbols]
+            np.save(os.path.join(store_dir, column + ".npy"),
+                    np.concatenate(values) if values else np.zeros(0))
+        with open(os.path.join(store_dir, STORE_INDEX), "w") as f:
+            f.writelines(["{}\t{}\n".format(symbol, self.company[symbol] or "") for symbol in self.symbols])
+        return self
+
+    def load(self, store_dir, cs_dict=None, mmap=True):
+        """
+        :param cs_dict: mapping of stock symbols to company names, overrides the mapping of the store
+        :param mmap: memory map the columns, every symbol is a view into them
+        """
+        mmap_mode = 'r' if mmap else None
+        offsets = np.load(os.path.join(store_dir, "offsets.npy"))
+        arrays = dict((column, np.load(os.path.join(store_dir, column + ".npy"), mmap_mode=mmap_mode))
+                      for column in STORE_COLUMNS)
+        with open(os.path.join(store_dir, STORE_INDEX), "r") as f:
+            index = [line.rstrip("\n").split("\t", 1) for line in f]
+
+        for i, (symbol, company) in enumerate(index):
+            if cs_dict is not None:
+                company = cs_dict.get(symbol)
+            self.set_symbol(symbol, company or None,
+                            dict((column, arrays[column][offsets[i]:offsets[i + 1]]) for column in STORE_COLUMNS))
+        return self
+
+    def symbol_columns(self, symbol, file_order=False):
+        """
+        :param file_order: return the records in the order of the raw file instead of by date
+        :return: dict {column -> array}, dates as datetime64[D]
+        """
+        columns = self.columns[symbol]
+        order = np.argsort(columns["row"], kind='mergesort') if file_order else slice(None)
+        columns = dict((column, np.asarray(value)[order]) for column, value in columns.iteritems())
+        columns["date"] = columns["date"].view('datetime64[D]')
+        return columns
+
+    def frame(self, symbol):
+        """
+        :return: DataFrame {Date, Open, High, Low, Close, Volume} in raw file order, Date as "YYYY-MM-DD"
+        """
+        columns = self.symbol_columns(symbol, file_order=True)
+        df = pd.DataFrame(dict((raw, columns[column]) for raw, column in zip(RAW_COLUMNS[1:], PRICE_COLUMNS)),
+                          columns=RAW_COLUMNS[1:])
+        df.insert(0, "Date", columns["date"].astype(str).astype(object))
+        return df
+
+    def query(self, company, start=None, end=None, columns=("open", "close")):
+        """
+        records of a company with start <= date <= end, by binary search on the sorted dates
+        :param start: first date (anything datetime64[D] accepts), None for no bound
+        :param end: last date, None for no bound
+        :return: dates, list of arrays for the requested columns (views into the store)
+        """
+        company_columns = self.columns[self.company_symbol[company]]
+        dates = company_columns["date"].view('datetime64[D]')
+        lo = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+        return dates[lo:hi], [company_columns[column][lo:hi] for column in columns]
+
+    def join(self, companies, dates):
+        """
+        look up (company, date) pairs with one searchsorted per company
+        :param companies: array of company names
+        :param dates: array of dates (datetime64[D]), aligned with companies
+        :return: matched (bool mask), Open, Close (nan where not matched)
+        """
+        companies = np.asarray(companies)
+        days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+        matched = np.zeros(len(days), dtype=bool)
+        Open = np.full(len(days), np.nan)
+        Close = np.full(len(days), np.nan)
+
+        names, codes = np.unique(companies, return_inverse=True)
+        order = np.argsort(codes, kind='mergesort')
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+
+        for code, company in enumerate(names):
+            columns = self.company_columns(company)
+            if columns is None or len(columns["date"]) == 0:
+                continue
+            rows = order[bounds[code]:bounds[code + 1]]
+            stock_days = columns["date"]
+            pos = np.searchsorted(stock_days, days[rows])
+            pos = np.minimum(pos, len(stock_days) - 1)
+            hit = stock_days[pos] == days[rows]
+            rows = rows[hit]
+            pos = pos[hit]
+            matched[rows] = True
+            Open[rows] = columns["open"][pos]
+            Close[rows] = columns["close"][pos]
+
+        return matched, Open, Close
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [3, 4]:
+        print "usage: python price_store.py $raw_stock_folder $store_dir [$company_stock_mapping]"
+        exit(1)
+    cs_dict = None
+    if len(sys.argv) == 4:
+        with open(sys.argv[3]) as f:
+            f.readline()  # header
+            cs_dict = dict(csv.reader(f, delimiter=','))
+    PriceStore().load_raw(sys.argv[1], cs_dict).save(sys.argv[2])
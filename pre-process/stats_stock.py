@@ -2,8 +2,15 @@
 statistical information regarding the dataset
 """
 from os import listdir
-import re
+from multiprocessing import Pool
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import as_strided
+from label_engine import label_matrix
+from price_store import is_store, open_store, read_stock_file, symbol_of
+from trading_calendar import parse_days, format_days, unique_last, join_days, INVALID_DAY
+
+HEADER_LAGS = "#num_previous_days="  # first line of label files, records the number of lags L
 
 def load_mapping(f_stock_mapping):
     """
@@ -90,13 +97,144 @@ def get_labels_trend(x, sig_pctg=1):
         print 'ERROR: Cant generate label for abs({}) < {}'.format(x, sig_pctg)
 
 
+def coverage_table(corpus_coverage, companies=None):
+    """
+    :param corpus_coverage: dict of {company_name -> [dates, line_number]}, from load_corpus
+    :param companies: companies to keep, defaults to all
+    :return: dict of {company_name -> (days, docs)}, int arrays sorted by day number,
+             one document per day, the last document of a day wins
+    """
+    if companies is None:
+        companies = corpus_coverage.keys()
+    table = dict()
+    for company in companies:
+        if company in corpus_coverage and company not in table:
+            days = parse_days([record[0] for record in corpus_coverage[company]], errors='coerce')
+            docs = np.array([record[1] for record in corpus_coverage[company]], dtype=np.int64)
+            valid = days != INVALID_DAY  # malformed dates never match a stock record
+            days, docs = days[valid], docs[valid]
+            last = unique_last(days)
+            table[company] = days[last], docs[last]
+    return table
+
+
+def lag_matrix(values, num_lags, start=1, fill=np.nan):
+    """
+    lags of a per-company array as a strided view, no (N, num_lags) copy is made
+    :param values: array (N,), e.g. percentage changes or doc indexes of one company
+    :param num_lags: number of lags L
+    :param start: offset of the first lag, 1 for the previous day, 0 to include the day itself
+    :param fill: value for lags past the end of values
+    :return: read-only array (N, L), row i is values[i + start: i + start + L]
+    """
+    values = np.asarray(values)
+    padded = np.concatenate([values, np.full(start + num_lags, fill, dtype=values.dtype)])
+    stride = padded.strides[0]
+    return as_strided(padded[start:], shape=(len(values), num_lags), strides=(stride, stride), writeable=False)
+
+
+def metadata_header(num_previous_days):
+    return "{}{}\n".format(HEADER_LAGS, num_previous_days)
+
+
+def parse_metadata_header(line):
+    """
+    :return: number of lags recorded in a label file header line, None if line is not a header
+    """
+    if line.startswith(HEADER_LAGS):
+        return int(line.strip()[len(HEADER_LAGS):])
+    return None
+
+
+def _str_columns(matrix):
+    """
+    format a matrix column by column with str(), as the label files always did
+    """
+    return [map(str, column) for column in matrix.T.tolist()]
+
+
+_coverage = None  # coverage_table shared with forked stock workers
+_prices = None  # PriceStore shared with forked stock workers, None to read raw files
+
+
+def stock_prices(stock_dir, name):
+    """
+    :param name: symbol if the global price store is set, raw file name otherwise
+    :return: dates (as written in the raw file), day numbers, Open prices, in raw file order
+    """
+    if _prices is not None:
+        columns = _prices.symbol_columns(name, file_order=True)
+        days = columns["date"].astype(np.int32)
+        return format_days(days), days, columns["open"]
+    df = read_stock_file(stock_dir + name)
+    return df["Date"].values, parse_days(df["Date"].values), df["Open"].values.astype(np.float64)
+
+
+def stock_label_lines(dates, days, Open, company, doc_table, sig_pctg=1, insig_pctg=None,
+                      num_previous_days=0, use_stock_prices=False):
+    """
+    label lines of one stock, see combine_stock_label
+    :param dates: dates of the stock records, in raw file order, written to the output
+    :param days: day numbers of the dates (see trading_calendar.parse_days), used for the join
+    :param Open: opening prices, aligned with dates
+    :param doc_table: (days, docs) of the company, from coverage_table
+    :return: lines, number of significant records, number of insignificant records, error messages
+    """
+    dates = np.asarray(dates)
+    Open = np.asarray(Open, dtype=np.float64)
+    Open_1 = np.concatenate([[np.nan], Open[:-1]])
+    change = (Open_1 - Open) / Open
+    change = change * 100
+
+    doc = join_days(days, doc_table[0], doc_table[1], fill=-1)
+    covered = doc >= 0
+
+    labels, valid = label_matrix(change, [(sig_pctg, insig_pctg, None, None)])
+    sig = labels[:, 0] != 0
+    errors = []
+
+    if insig_pctg is None:
+        rows = np.flatnonzero(covered & sig)
+        cnt_sig, cnt_insig = len(rows), 0
+        # labels of the trend use a fixed 1% threshold
+        trend = np.abs(change[rows]) >= 1
+        label = np.where(change[rows] > 0, "1", "0").astype(object)
+        label[~trend] = "None"
+        errors = ['ERROR: Cant generate label for abs({}) < {}'.format(x, 1) for x in change[rows][~trend].tolist()]
+    else:
+        insig = valid[:, 0] & ~sig
+        rows = np.flatnonzero(covered & (sig | insig))
+        cnt_sig, cnt_insig = int(np.sum(sig[rows])), int(np.sum(insig[rows]))
+        label = np.where(sig[rows], "1", "0")
+
+    columns = [[company] * len(rows), dates[rows].tolist(), map(str, doc[rows].tolist())]
+    if use_stock_prices:
+        columns.append(map(str, Open_1[rows].tolist()))
+        columns.extend(_str_columns(lag_matrix(Open, num_previous_days, start=0)[rows]))
+    else:
+        columns.append(map(str, change[rows].tolist()))
+        columns.extend(_str_columns(lag_matrix(change, num_previous_days)[rows]))
+        columns.extend(_str_columns(lag_matrix(doc, num_previous_days, fill=-1)[rows]))
+    columns.append(label.tolist())
+
+    lines = [",".join(fields) + "\n" for fields in zip(*columns)]
+    return lines, cnt_sig, cnt_insig, errors
+
+
+def _stock_label_lines(args):
+    stock_dir, name, company = args[:3]
+    dates, days, Open = stock_prices(stock_dir, name)
+    return stock_label_lines(dates, days, Open, company, _coverage[company], *args[3:])
+
+
 def combine_stock_label(stock_dir, corpus_coverage, map_sym_comp, labels_out, sig_pctg=1, insig_pctg=None,
-                        num_previous_days=0, use_stock_prices=False):
+                        num_previous_days=0, use_stock_prices=False, processes=None):
     """
     Combine the stock data with the label information. Datapoints that do not have a corresponding document in the
-    corpus are filtered out.
+    corpus are filtered out. The first line of the output is a header recording num_previous_days (see
+    metadata_header), each record has num_previous_days changes and doc indexes (or prices) of the previous days.
 
-    :param stock_dir: Path to folder with stock price data
+    :param stock_dir: Path to folder with stock price data, or to a price store (see price_store.py)
     :param corpus_coverage: Information about which dates are covered in corpus
     :param map_sym_comp: Mapping of stock symbols (AAPL) to company names (Apple Inc.)
     :param labels_out: Output file
@@ -104,92 +242,45 @@ def combine_stock_label(stock_dir, corpus_coverage, map_sym_comp, labels_out, si
     :param insig_pctg: Threshold for insignificant price change, None if insignificant irrelevant
     :param num_previous_days: Number of previous days of stock information
     :param use_stock_prices: Use stock prices instead of stock changes
+    :param processes: Number of worker processes, each takes one stock file at a time
     """
 
     corpus_sig = dict()
 
-    l_out = open(labels_out, 'w')
+    global _coverage, _prices
+    if is_store(stock_dir):
+        _prices = open_store(stock_dir)
+        names = _prices.symbols
+    else:
+        _prices = None
+        names = listdir(stock_dir)
 
-    for stock_file in listdir(stock_dir):
+    tasks = []
+    for name in names:
         # parse to get company name
-        symbol = re.sub(r'.*_', '', stock_file)
-        symbol = symbol.replace('.csv', '')
-        if symbol in map_sym_comp:
-            company = map_sym_comp[symbol]
-        else:
-            continue
-
-        # get dates with valid documents
-        if company in corpus_coverage:
-            doc_dates = dict()
-            doc_tuples = corpus_coverage[company]
-            for doc_tuple in doc_tuples:
-                doc_dates[doc_tuple[0]] = doc_tuple[1]
-        else:
-            continue
-
-        # get significance label
-        stock_file = stock_dir + stock_file
-        df = pd.read_csv(stock_file)
-        df['Open_1'] = df['Open'].shift(+1)
-        df['Change_per'] = (df['Open_1'] - df['Open']) / df['Open']
-        df['Change_per'] = df.apply(lambda row: (row['Change_per']) * 100, axis=1)
-        df['sig?'] = df.apply(lambda row: significant_change(row['Change_per'], sig_pctg), axis=1)
-        if insig_pctg is not None:
-            df['insig?'] = df.apply(lambda row: insignificant_change(row['Change_per'], insig_pctg), axis=1)
-
-        for i in range(num_previous_days):
-            i += 1
-            df['Change_per_{}'.format(i)] = df['Change_per'].shift(-i)
-            df['Change_per_{}_Date'.format(i)] = df['Date'].shift(-i)
-
-        for i in range(num_previous_days):
-            df['Open_hist_{}'.format(i)] = df['Open'].shift(-i)
-
-        # print df[20:30]
-
-        # df = df.ix[:, ['Date', 'Change_per', 'sig?']]
-        cnt_sig = 0
-        cnt_insig = 0
-        for idx, row in df.iterrows():
-            if row["Date"] in doc_dates.keys():
-                if insig_pctg is None:
-                    if row["sig?"] == 1:
-                        label = get_labels_trend(row["Change_per"], sig_pctg=1)
-                        cnt_sig += 1
-                    else:
-                        continue
-                else:
-                    if row["sig?"] == 1 or row["insig?"] == 1:
-                        if row["sig?"] == 1:
-                            label = 1
-                            cnt_sig += 1
-                        else:
-                            label = 0
-                            cnt_insig += 1
-                    else:
-                        continue
-
-
-
-                if use_stock_prices:
-                    l_out.write("{},{},{},{}".format(
-                        company, row["Date"], doc_dates[row["Date"]], row["Open_1"]))
-                    for i in range(num_previous_days):
-                        l_out.write(",{}".format(row['Open_hist_{}'.format(i)]))
-                else:
-                    l_out.write("{},{},{},{}".format(
-                        company, row["Date"], doc_dates[row["Date"]], row["Change_per"]))
-                    for i in range(num_previous_days):
-                        i += 1
-                        l_out.write(",{}".format(row['Change_per_{}'.format(i)]))
-                    for i in range(num_previous_days):
-                        i += 1
-                        date = row['Change_per_{}_Date'.format(i)]
-                        date = doc_dates[date] if date in doc_dates else -1
-                        l_out.write(",{}".format(date))
-
-                l_out.write(",{}\n".format(label))
+        symbol = symbol_of(name)
+        if symbol in map_sym_comp and map_sym_comp[symbol] in corpus_coverage:
+            tasks.append((stock_dir, name, map_sym_comp[symbol],
+                          sig_pctg, insig_pctg, num_previous_days, use_stock_prices))
+
+    _coverage = coverage_table(corpus_coverage, [task[2] for task in tasks])
+
+    if processes == 1:
+        results = map(_stock_label_lines, tasks)
+    else:
+        pool = Pool(processes)
+        results = pool.map(_stock_label_lines, tasks)
+        pool.close()
+        pool.join()
+
+    l_out = open(labels_out, 'w')
+    l_out.write(metadata_header(num_previous_days))
+
+    for task, (lines, cnt_sig, cnt_insig, errors) in zip(tasks, results):
+        company = task[2]
+        for error in errors:
+            print error
+        l_out.writelines(lines)
         corpus_sig[company] = cnt_sig, cnt_insig
         print company, cnt_sig, cnt_insig
 
@@ -0,0 +1,64 @@
+"""
+vectorized topic history against the original per-row loop of FeatureGenerator.feature_topic_hist
+run from pre-process/: python -m unittest test_feature_prep
+"""
+import unittest
+import numpy as np
+from feature_prep import topic_history, topic_history_windows
+
+
+def loop_topic_history(topic_dist, company, decay, window_size):
+    """
+    the per-row loop topic_history replaced
+    """
+    topic_hist = []
+    for idx in range(len(topic_dist)):
+        hist = np.zeros(topic_dist[idx].shape)
+        for idx_w in range(1, window_size+1):
+            if idx-idx_w < 0:
+                continue
+            if company[idx-idx_w] != company[idx]: # out of boundry
+                continue
+            hist += topic_dist[idx-idx_w] * (decay ** idx_w)
+        topic_hist.append(hist)
+    return np.array(topic_hist)
+
+
+class TopicHistoryTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # company runs of different lengths, A comes back after B (non-contiguous runs)
+        self.company = ["A"] * 5 + ["B"] * 2 + ["A"] * 4 + ["C"] + ["B"] * 6
+        self.company_code = np.unique(self.company, return_inverse=True)[1]
+        self.topic_dist = rng.dirichlet(np.ones(4), len(self.company))
+
+    def check(self, decay, window_size):
+        expected = loop_topic_history(self.topic_dist, self.company, decay, window_size)
+        result = topic_history(self.topic_dist, self.company_code, decay, window_size)
+        np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-15)
+
+    def test_short_windows(self):
+        for window_size in [1, 2, 3]:
+            self.check(0.75, window_size)
+
+    def test_window_longer_than_runs(self):
+        self.check(0.5, 5)  # longer than the B, A and C runs
+        self.check(1.0, 7)
+
+    def test_window_longer_than_data(self):
+        self.check(0.75, len(self.company))
+        self.check(0.75, len(self.company) + 3)
+
+    def test_single_row(self):
+        expected = loop_topic_history(self.topic_dist[:1], self.company[:1], 0.75, 2)
+        result = topic_history(self.topic_dist[:1], self.company_code[:1], 0.75, 2)
+        np.testing.assert_allclose(result, expected)
+
+    def test_windows_match_each_window_size(self):
+        for window_size, hist in topic_history_windows(self.topic_dist, self.company_code, 0.9, 8):
+            expected = loop_topic_history(self.topic_dist, self.company, 0.9, window_size)
+            np.testing.assert_allclose(hist, expected, rtol=1e-12, atol=1e-15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+one-pass chi2 / mutual information against sklearn.feature_selection
+run from pre-process/: python -m unittest test_feature_selection
+"""
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_selection import chi2, mutual_info_classif
+from feature_selection import ClassCounts, sparse_chi2, sparse_mutual_info
+
+
+def random_counts(rng, num_samples, num_features, density=0.3, max_count=4):
+    X = rng.randint(1, max_count + 1, size=(num_samples, num_features))
+    X[rng.rand(num_samples, num_features) > density] = 0
+    X[:, 0] = 0  # a column without counts
+    return csr_matrix(X)
+
+
+class FeatureSelectionTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def check_chi2(self, X, y):
+        scores, pvalues = sparse_chi2(X, y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            expected_scores, expected_pvalues = chi2(X, y)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-10)
+        np.testing.assert_allclose(pvalues, expected_pvalues, rtol=1e-8, atol=1e-300)
+
+    def check_mutual_info(self, X, y):
+        np.testing.assert_allclose(sparse_mutual_info(X, y),
+                                   mutual_info_classif(X, y, discrete_features=True),
+                                   rtol=1e-10, atol=1e-12)
+
+    def test_two_classes(self):
+        X = random_counts(self.rng, 40, 12)
+        y = self.rng.choice([-1, 1], 40)
+        self.check_chi2(X, y)  # p-values through erfc
+        self.check_mutual_info(X, y)
+
+    def test_three_classes(self):
+        X = random_counts(self.rng, 60, 15)
+        y = self.rng.choice([-1, 0, 1], 60)
+        self.check_chi2(X, y)  # p-values through chdtrc
+        self.check_mutual_info(X, y)
+
+    def test_binary_counts(self):
+        X = random_counts(self.rng, 30, 8, density=0.5, max_count=1)
+        y = self.rng.choice([0, 1], 30)
+        self.check_chi2(X, y)
+        self.check_mutual_info(X, y)
+
+    def test_explicit_zeros(self):
+        X = random_counts(self.rng, 20, 6)
+        X.data[::3] = 0  # stored zeros count as the zero category
+        y = self.rng.choice([0, 1], 20)
+        self.check_chi2(X, y)
+        self.check_mutual_info(X, y)
+
+    def test_class_totals(self):
+        y = np.array([1, -1, 1, 1, -1])
+        counts = ClassCounts(random_counts(self.rng, 5, 3), y)
+        np.testing.assert_array_equal(counts.classes, [-1, 1])
+        np.testing.assert_array_equal(counts.class_total, [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
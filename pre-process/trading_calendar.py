@@ -0,0 +1,124 @@
+"""
+trading-day calendar shared by the stock and corpus pipelines
+date strings are parsed once, vectorized, into int32 day numbers (days since 1970-01-01),
+trading days are numbered by int32 ordinals, so joins, lags and splits compare integers
+same-day joins (join_days, PriceStore.join) are keyed on day numbers: on an exact match they pair the
+same records as trading-day ordinals would, without building a calendar first; ordinals are used where
+distances are counted in trading days (data_split.walk_forward_splits)
+"""
+
+import numpy as np
+
+DATE_LENGTH = 10  # "YYYY-MM-DD", anything after it (e.g. "T00:00:00Z") is ignored
+INVALID_DAY = np.iinfo(np.int32).min  # day number of a malformed date with errors='coerce'
+
+
+def parse_days(dates, errors='raise'):
+    """
+    :param dates: iterable of "YYYY-MM-DD..." strings, datetime.date or datetime64 values
+    :param errors: 'raise' on a malformed or empty date, 'coerce' to give it INVALID_DAY
+    :return: int32 array of day numbers
+    """
+    dates = np.asarray(dates)
+    if dates.dtype.kind in "OSU":
+        # a fixed width string cast truncates every date to its first DATE_LENGTH characters at once
+        dates = dates.astype("S{}".format(DATE_LENGTH))
+    try:
+        days = dates.astype("datetime64[D]")
+    except ValueError:
+        if errors != 'coerce':
+            raise
+        days = np.array([_parse_day(date) for date in dates], dtype="datetime64[D]")
+    invalid = np.isnat(days)  # empty strings parse as NaT, which has no int32 day number
+    if errors == 'coerce':
+        days = days.astype(np.int64)
+        days[invalid] = INVALID_DAY
+    elif np.any(invalid):
+        raise ValueError("Error parsing datetime string {!r}".format(dates[np.argmax(invalid)]))
+    return days.astype(np.int32)
+
+
+def _parse_day(date):
+    try:
+        return np.datetime64(date, 'D')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+def day_number(date):
+    """
+    :param date: a single date, see parse_days
+    """
+    return int(parse_days([date])[0])
+
+
+def format_days(days):
+    """
+    :return: "YYYY-MM-DD" strings of day numbers
+    """
+    return np.asarray(days).astype("datetime64[D]").astype(str).astype(object)
+
+
+def unique_last(days):
+    """
+    :return: positions of the last occurrence of every distinct day, ordered by day
+    """
+    order = np.argsort(days, kind='mergesort')
+    if len(order) == 0:
+        return order
+    sorted_days = np.asarray(days)[order]
+    return order[np.concatenate([sorted_days[1:] != sorted_days[:-1], [True]])]
+
+
+def join_days(days, table_days, table_values, fill=-1):
+    """
+    integer join of days against a table sorted by day with unique days
+    :return: table_values at the matching day, fill where there is none
+    """
+    days = np.asarray(days)
+    values = np.full(len(days), fill, dtype=np.asarray(table_values).dtype)
+    if len(table_days) == 0:
+        return values
+    pos = np.minimum(np.searchsorted(table_days, days), len(table_days) - 1)
+    hit = table_days[pos] == days
+    values[hit] = np.asarray(table_values)[pos[hit]]
+    return values
+
+
+class TradingCalendar:
+    """
+    sorted trading days, the ordinal of a trading day is its position
+    """
+    def __init__(self, days):
+        self.days = np.unique(np.asarray(days, dtype=np.int32))
+
+    @staticmethod
+    def from_store(price_store):
+        """
+        :param price_store: PriceStore, every date with a record of any symbol is a trading day
+        """
+        days = [np.asarray(columns["date"]) for columns in price_store.columns.itervalues()]
+        return TradingCalendar(np.concatenate(days) if days else [])
+
+    def __len__(self):
+        return len(self.days)
+
+    def ordinals(self, days, exact=True):
+        """
+        :param days: day numbers, e.g. from parse_days
+        :param exact: map non-trading days to -1, otherwise to the next trading day
+        :return: int32 array of trading-day ordinals
+        """
+        days = np.asarray(days, dtype=np.int32)
+        ordinals = np.searchsorted(self.days, days, side='left').astype(np.int32)
+        if exact:
+            hit = ordinals < len(self.days)
+            hit[hit] = self.days[ordinals[hit]] == days[hit]
+            ordinals[~hit] = -1
+        return ordinals
+
+    def days_of(self, ordinals):
+        """
+        :return: day numbers of trading-day ordinals
+        """
+        return self.days[np.asarray(ordinals)]